@@ -1,17 +1,42 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask import send_from_directory
-from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity, verify_jwt_in_request, current_user, \
+    get_jwt, decode_token
 from flask_login import LoginManager
 from datetime import datetime, timedelta
 import re
 import os
 
-from models import db, User, Post, Comment, Playlist, Review, Concert, Tag, Follow, Course
+from models import db, seed_database, User, Post, PostLike, Comment, Playlist, PlaylistTrack, Review, Concert, Tag, Follow, Course, \
+    Notification, Conversation, Message
 from config import Config
+from database import init_database, ignore_conflicts
+from loaders import grouped_counts, load_user_stats, load_users, load_post_authors, load_playlist_creators, load_tracks_counts, dump_users
+from counters import rebuild_user_stats, init_counters, change_post_counter, current_likes, counters_stats, \
+    likes_buffer, views_buffer, plays_buffer, hot_posts
+from pagination import paginate_listing, keyset_page, get_per_page, InvalidCursor
+from migrations import run_migrations, explain
+from search import search, rebuild_search_index
+from suggest import suggestions, ensure_suggestions, start_refresh
+from tasks import tasks
+from feed import get_feed, fanout_post, backfill_follow, prune_follow
+from site_stats import site_stats, init_site_stats
+from cache import response_cache, cached, invalidate, tag_response
+from serializers import JSONProvider, post_summary, post_full, comment_schema, playlist_summary, \
+    playlist_full, concert_summary, course_summary, notification_schema, message_schema, conversation_schema
+from passwords import hasher, HasherBusy
+from identity import identities
+from revocation import blocklist
+from replicas import replicas
+from notifications import hub, unread_counts, mark_read, post_liked
+from messaging import send_message, mark_conversation_read, unread_total, get_history
+from conditional import conditional, post_validators, user_validators, playlist_validators
 from flask import send_file
+from sqlalchemy.orm import defer
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.config.from_object(Config)
 
 cors_origins = app.config.get('CORS_ORIGINS')
@@ -33,9 +58,21 @@ CORS(app, resources={
     }
 }, supports_credentials=True)
 
-db.init_app(app)
+init_database(app)
 jwt = JWTManager(app)
+identities.init_app(app, jwt)
+blocklist.init_app(app, jwt)
 login_manager = LoginManager(app)
+tasks.init_app(app)
+init_counters(app)
+init_site_stats(app)
+response_cache.init_app(app)
+hasher.init_app(app)
+replicas.init_app(app)
+hub.init_app(app)
+unread_counts.init_app(app)
+if app.config['SUGGEST_REFRESH_SECONDS'] > 0:
+    start_refresh(app, app.config['SUGGEST_REFRESH_SECONDS'])
 
 @app.after_request
 def after_request(response):
@@ -47,36 +84,101 @@ def after_request(response):
         response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
-#БДшка
-def init_db():
+@app.errorhandler(InvalidCursor)
+def handle_invalid_cursor(e):
+    return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.errorhandler(HasherBusy)
+def handle_hasher_busy(e):
+    db.session.rollback()
+    return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '1'}
+
+def bootstrap():
+    """Создание схемы, миграции и начальные данные. Выполняется один раз при деплое,
+    а не при импорте: воркеры gunicorn (и --preload) стартуют без обращений к базе."""
     with app.app_context():
         db.create_all()
-        
-        # Тестовый пользователь
-        if User.query.count() == 0:
-            admin = User(
-                username='admin',
-                email='admin@musblossom.com',
-                bio='Основатель MusBlossom'
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-            
-            # Тестовый пользователь
-            test_user = User(
-                username='testuser',
-                email='test@musblossom.com',
-                bio='Тестовый пользователь'
-            )
-            test_user.set_password('test123')
-            db.session.add(test_user)
-            
-            db.session.commit()
-            print("База данных инициализирована. Созданы пользователи admin и testuser")
-
-# БД
-with app.app_context():
-    init_db()
+        applied = run_migrations()
+        created = seed_database()
+    return applied, created
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Создание схемы, миграции и начальные данные"""
+    applied, created = bootstrap()
+    for version, name in applied:
+        print(f"Применена миграция {version}: {name}")
+    if created:
+        print(f"Созданы начальные данные: {', '.join(created)}")
+    print("База данных готова")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Применение миграций схемы"""
+    applied = run_migrations()
+    for version, name in applied:
+        print(f"Применена миграция {version}: {name}")
+    if not applied:
+        print("Схема актуальна")
+
+@app.cli.command('search-reindex')
+def search_reindex_command():
+    """Перестроение полнотекстового индекса по существующим строкам"""
+    with db.engine.begin() as connection:
+        rebuild_search_index(connection)
+    print("Поисковый индекс перестроен")
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """Планы запросов для списков"""
+    listing_queries = {
+        'posts': Post.query.order_by(Post.created_at.desc(), Post.id.desc()).limit(10),
+        'posts by type': Post.query.filter_by(post_type='thought')
+            .order_by(Post.created_at.desc(), Post.id.desc()).limit(10),
+        'user posts': Post.query.filter_by(user_id=1)
+            .order_by(Post.created_at.desc(), Post.id.desc()).limit(10),
+        'post comments': Comment.query.filter_by(post_id=1, parent_comment_id=None)
+            .order_by(Comment.created_at.desc(), Comment.id.desc()).limit(10),
+        'comment replies': Comment.query.filter_by(parent_comment_id=1)
+            .order_by(Comment.created_at.desc(), Comment.id.desc()).limit(10),
+        'followers': Follow.query.filter_by(followed_id=1),
+        'playlists': Playlist.query.filter_by(is_public=True)
+            .order_by(Playlist.created_at.desc(), Playlist.id.desc()).limit(10),
+        'notifications': Notification.query.filter_by(user_id=1)
+            .order_by(Notification.created_at.desc(), Notification.id.desc()).limit(10),
+        'unread notifications': Notification.query.filter_by(user_id=1, is_read=False),
+        'conversations': Conversation.query.filter_by(user_id=1)
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(10),
+        'unread messages': db.session.query(db.func.count(Message.id))
+            .filter(Message.receiver_id == 1, Message.is_read.is_(False)),
+        'message history': Message.query.filter_by(sender_id=1, receiver_id=2)
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(11),
+        'concerts': Concert.query.filter(Concert.date >= datetime.now())
+            .filter_by(city='Moscow', country='Russia').order_by(Concert.date.asc()),
+    }
+    for name, query in listing_queries.items():
+        print(f"-- {name}")
+        for line in explain(query):
+            print(f"   {line}")
+
+@app.cli.command('replica-sync')
+def replica_sync_command():
+    """Копирование основной базы SQLite в реплики SQLite"""
+    synced = replicas.sync_sqlite()
+    print(f"Синхронизировано реплик: {synced}")
+
+@app.cli.command('repair-stats')
+def repair_stats_command():
+    """Пересчёт счётчиков user_stats"""
+    count = rebuild_user_stats()
+    print(f"Счётчики пересчитаны для {count} пользователей")
+
+def bio_error(bio):
+    """Ошибка длины bio: оно выводится в карточке автора в каждом списке и в поиске"""
+    limit = app.config['BIO_MAX_LENGTH']
+    if isinstance(bio, str) and len(bio.strip()) > limit:
+        return f'Описание профиля не должно превышать {limit} символов'
+    return None
 
 #Аутентификация 
 @app.route('/api/auth/register', methods=['POST'])
@@ -113,17 +215,21 @@ def api_register():
     elif len(password) < 6:
         errors['password'] = 'Пароль должен содержать минимум 6 символов'
     
+    error = bio_error(bio)
+    if error:
+        errors['bio'] = error
+    
     if errors:
         return jsonify({'success': False, 'errors': errors}), 400
     
+    user = User(
+        username=username,
+        email=email,
+        bio=bio
+    )
+    user.set_password(password)
+    
     try:
-        user = User(
-            username=username,
-            email=email,
-            bio=bio
-        )
-        user.set_password(password)
-        
         db.session.add(user)
         db.session.commit()
 
@@ -157,6 +263,8 @@ def api_login():
     user = User.query.filter_by(email=email).first()
     
     if user and user.check_password(password):
+        if user.password_needs_rehash():
+            user.set_password(password)
         user.last_login = datetime.now()
         db.session.commit()
         
@@ -177,24 +285,64 @@ def api_login():
 @jwt_required(refresh=True)
 def api_refresh():
     current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
     
     new_access_token = create_access_token(identity=current_user_id)
     
     return jsonify({
         'success': True,
         'access_token': new_access_token,
-        'user': user.to_dict()
+        'user': current_user_data()
+    }), 200
+
+@app.route('/api/auth/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def api_logout():
+    blocklist.revoke(get_jwt())
+    
+    # Вместе с access-токеном можно отозвать и refresh-токен этой сессии
+    data = request.get_json(silent=True) or {}
+    if data.get('refresh_token'):
+        try:
+            payload = decode_token(data['refresh_token'])
+        except Exception:
+            return jsonify({'success': False, 'error': 'Некорректный refresh-токен'}), 400
+        if payload['sub'] == get_jwt_identity() and not blocklist.is_revoked(payload):
+            blocklist.revoke(payload)
+    
+    return jsonify({
+        'success': True,
+        'message': 'Выход выполнен'
     }), 200
 
 @app.route('/api/auth/me', methods=['GET'])
 @jwt_required()
 def api_get_current_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    return jsonify({
+        'success': True,
+        'user': current_user_data()
+    }), 200
+
+def current_user_data():
+    """Профиль из кеша идентичности и актуальные счётчики из user_stats"""
+    user_id = current_user['id']
+    return {**current_user, 'stats': load_user_stats([user_id])[user_id]}
+
+def serialize_post_list(posts):
+    return post_summary.dump_many(posts, users=load_post_authors(posts))
+
+# Пользователи
+@app.route('/api/users/<int:user_id>', methods=['GET'])
+def api_get_user(user_id):
+    validators = user_validators(user_id)
+    
+    if not validators:
+        return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
+    
+    return conditional(validators, lambda: render_user(user_id))
+
+@cached(tags=lambda user_id: [f'user:{user_id}'])
+def render_user(user_id):
+    user = User.query.get(user_id)
     
     if not user:
         return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
@@ -204,84 +352,85 @@ def api_get_current_user():
         'user': user.to_dict()
     }), 200
 
-# Пользователи
-@app.route('/api/users/<int:user_id>', methods=['GET'])
-def api_get_user(user_id):
+@app.route('/api/users/<int:user_id>/stats', methods=['GET'])
+def api_get_user_stats(user_id):
     user = User.query.get(user_id)
     
     if not user:
         return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
     
+    stats = user.get_stats()
+    
+    verify_jwt_in_request(optional=True)
+    current_user_id = get_jwt_identity()
+    is_following = False
+    if current_user_id and current_user_id != user_id:
+        is_following = Follow.query.filter_by(
+            follower_id=current_user_id,
+            followed_id=user_id
+        ).first() is not None
+    
     return jsonify({
         'success': True,
-        'user': user.to_dict()
+        'stats': {
+            'posts': stats['posts_count'],
+            'followers': stats['followers_count'],
+            'following': stats['following_count'],
+            'friends': stats['friends_count'],
+            'playlists': stats['playlists_count'],
+            'reviews': stats['reviews_count']
+        },
+        'is_following': is_following
     }), 200
 
 @app.route('/api/users/<int:user_id>/posts', methods=['GET'])
 def api_get_user_posts(user_id):
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    
-    posts = Post.query.filter_by(user_id=user_id)\
-        .order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
-    
-    posts_data = [{
-        'id': post.id,
-        'title': post.title,
-        'content': post.content[:200] + '...' if len(post.content) > 200 else post.content,
-        'author': post.author.to_dict(),
-        'post_type': post.post_type,
-        'track_name': post.track_name,
-        'artist_name': post.artist_name,
-        'created_at': post.created_at.isoformat(),
-        'likes_count': post.likes_count,
-        'comments_count': post.comments_count
-    } for post in posts.items]
+    posts, page_info = paginate_listing(Post.query.options(defer(Post.content)).filter_by(user_id=user_id), Post)
+    
+    posts_data = serialize_post_list(posts)
     
     return jsonify({
         'success': True,
         'posts': posts_data,
-        'total': posts.total,
-        'pages': posts.pages,
-        'current_page': page
+        **page_info
     }), 200
 
 # Посты
 @app.route('/api/posts', methods=['GET'])
+@cached(tags=lambda: ['posts', 'users'])
 def api_get_posts():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
     post_type = request.args.get('type', None)
     
-    query = Post.query
+    query = Post.query.options(defer(Post.content))
     
     if post_type:
         query = query.filter_by(post_type=post_type)
     
-    posts = query.order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
-    
-    posts_data = [{
-        'id': post.id,
-        'title': post.title,
-        'content': post.content[:200] + '...' if len(post.content) > 200 else post.content,
-        'author': post.author.to_dict(),
-        'post_type': post.post_type,
-        'track_name': post.track_name,
-        'artist_name': post.artist_name,
-        'created_at': post.created_at.isoformat(),
-        'likes_count': post.likes_count,
-        'comments_count': post.comments_count
-    } for post in posts.items]
+    posts, page_info = paginate_listing(query, Post)
+    tag_response(*(f'post:{post.id}' for post in posts))
+    
+    posts_data = serialize_post_list(posts)
     
     return jsonify({
         'success': True,
         'posts': posts_data,
-        'total': posts.total,
-        'pages': posts.pages,
-        'current_page': page
+        **page_info
     }), 200
+# Лента подписок
+@app.route('/api/feed', methods=['GET'])
+@jwt_required()
+def api_get_feed():
+    current_user_id = get_jwt_identity()
+    
+    posts, next_cursor = get_feed(current_user_id, request.args.get('cursor'), get_per_page())
+    
+    return jsonify({
+        'success': True,
+        'posts': serialize_post_list(posts),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }), 200
+
 # Создание поста
 @app.route('/api/posts', methods=['POST'])
 @jwt_required()
@@ -323,6 +472,9 @@ def api_create_post():
         db.session.add(post)
         db.session.commit()
         
+        invalidate('posts', f'user:{current_user_id}')
+        tasks.submit(fanout_post, post.id)
+        
         return jsonify({
             'success': True,
             'message': 'Пост создан',
@@ -343,30 +495,73 @@ def api_create_post():
 
 @app.route('/api/posts/<int:post_id>', methods=['GET'])
 def api_get_post(post_id):
+    validators = post_validators(post_id)
+    
+    if not validators:
+        return jsonify({'success': False, 'error': 'Пост не найден'}), 404
+    
+    views_buffer.add(post_id, 1)
+    
+    return conditional(validators, lambda: render_post(post_id))
+
+@cached(tags=lambda post_id: [f'post:{post_id}', 'users'])
+def render_post(post_id):
     post = Post.query.get(post_id)
     
     if not post:
         return jsonify({'success': False, 'error': 'Пост не найден'}), 404
     
-    comments = Comment.query.filter_by(post_id=post_id)\
-        .order_by(Comment.created_at.desc())\
-        .all()
+    comments, next_cursor = keyset_page(top_level_comments(post_id), Comment, None, get_per_page())
+    
+    post_data = post_full.dump(post, users=load_users([post.user_id]))
+    post_data['views_count'] = (post.views_count or 0) + views_buffer.pending(post_id)
     
     return jsonify({
         'success': True,
-        'post': {
-            'id': post.id,
-            'title': post.title,
-            'content': post.content,
-            'author': post.author.to_dict(),
-            'post_type': post.post_type,
-            'track_name': post.track_name,
-            'artist_name': post.artist_name,
-            'created_at': post.created_at.isoformat(),
-            'likes_count': post.likes_count,
-            'comments_count': post.comments_count
-        },
-        'comments': [comment.to_dict() for comment in comments]
+        'post': post_data,
+        'comments': serialize_comments(comments),
+        'comments_next_cursor': next_cursor,
+        'comments_has_more': next_cursor is not None
+    }), 200
+
+def top_level_comments(post_id):
+    return Comment.query.filter(Comment.post_id == post_id, Comment.parent_comment_id.is_(None))
+
+def serialize_comments(comments):
+    return comment_schema.dump_many(
+        comments,
+        users=load_users([comment.user_id for comment in comments]),
+        replies_counts=grouped_counts(Comment.parent_comment_id, [comment.id for comment in comments])
+    )
+
+@app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
+def api_get_comments(post_id):
+    if not db.session.query(Post.id).filter_by(id=post_id).first():
+        return jsonify({'success': False, 'error': 'Пост не найден'}), 404
+    
+    comments, next_cursor = keyset_page(top_level_comments(post_id), Comment,
+                                        request.args.get('cursor'), get_per_page())
+    
+    return jsonify({
+        'success': True,
+        'comments': serialize_comments(comments),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }), 200
+
+@app.route('/api/comments/<int:comment_id>/replies', methods=['GET'])
+def api_get_replies(comment_id):
+    if not db.session.query(Comment.id).filter_by(id=comment_id).first():
+        return jsonify({'success': False, 'error': 'Комментарий не найден'}), 404
+    
+    replies, next_cursor = keyset_page(Comment.query.filter_by(parent_comment_id=comment_id), Comment,
+                                       request.args.get('cursor'), get_per_page())
+    
+    return jsonify({
+        'success': True,
+        'replies': serialize_comments(replies),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
     }), 200
 
 #Коменты к постам
@@ -388,18 +583,26 @@ def api_create_comment(post_id):
     if not post:
         return jsonify({'success': False, 'error': 'Пост не найден'}), 404
     
+    parent_comment_id = data.get('parent_comment_id')
+    if parent_comment_id is not None:
+        parent = db.session.query(Comment.post_id).filter_by(id=parent_comment_id).first()
+        if not parent or parent.post_id != post_id:
+            return jsonify({'success': False, 'error': 'Родительский комментарий не найден'}), 404
+    
     try:
         comment = Comment(
             content=content,
             user_id=current_user_id,
-            post_id=post_id
+            post_id=post_id,
+            parent_comment_id=parent_comment_id
         )
         
-        post.comments_count += 1
-        
         db.session.add(comment)
+        change_post_counter(post_id, Post.comments_count, 1)
         db.session.commit()
         
+        invalidate(f'post:{post_id}')
+        
         return jsonify({
             'success': True,
             'message': 'Комментарий добавлен',
@@ -412,35 +615,27 @@ def api_create_comment(post_id):
 
 #Плейлисты
 @app.route('/api/playlists', methods=['GET'])
+@cached(tags=lambda: ['playlists', 'users'])
 def api_get_playlists():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
     user_id = request.args.get('user_id', None, type=int)
     
-    query = Playlist.query.filter_by(is_public=True)
+    query = Playlist.query.options(defer(Playlist.description)).filter_by(is_public=True)
     
     if user_id:
         query = query.filter_by(user_id=user_id)
     
-    playlists = query.order_by(Playlist.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    playlists, page_info = paginate_listing(query, Playlist)
     
-    playlists_data = [{
-        'id': playlist.id,
-        'name': playlist.name,
-        'description': playlist.description,
-        'creator': playlist.creator.to_dict(),
-        'is_public': playlist.is_public,
-        'created_at': playlist.created_at.isoformat(),
-        'tracks_count': len(playlist.tracks)
-    } for playlist in playlists.items]
+    playlists_data = playlist_summary.dump_many(
+        playlists,
+        users=load_playlist_creators(playlists),
+        tracks_counts=load_tracks_counts(playlists)
+    )
     
     return jsonify({
         'success': True,
         'playlists': playlists_data,
-        'total': playlists.total,
-        'pages': playlists.pages,
-        'current_page': page
+        **page_info
     }), 200
 
 #Создание плейлиста 
@@ -471,6 +666,8 @@ def api_create_playlist():
         db.session.add(playlist)
         db.session.commit()
         
+        invalidate('playlists', f'user:{current_user_id}')
+        
         return jsonify({
             'success': True,
             'message': 'Плейлист создан',
@@ -487,8 +684,63 @@ def api_create_playlist():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/playlists/<int:playlist_id>', methods=['GET'])
+def api_get_playlist(playlist_id):
+    found = playlist_validators(playlist_id)
+    
+    if found:
+        validators, is_public, owner_id = found
+        if not is_public:
+            verify_jwt_in_request(optional=True)
+            if get_jwt_identity() != owner_id:
+                found = None
+    
+    if not found:
+        return jsonify({'success': False, 'error': 'Плейлист не найден'}), 404
+    
+    return conditional(validators, lambda: render_playlist(playlist_id))
+
+def render_playlist(playlist_id):
+    playlist = Playlist.query.get(playlist_id)
+    
+    tracks = PlaylistTrack.query.filter_by(playlist_id=playlist_id)\
+        .order_by(PlaylistTrack.added_at, PlaylistTrack.id)\
+        .limit(20)\
+        .all()
+    users = load_users([playlist.user_id] + [track.added_by for track in tracks if track.added_by])
+    
+    playlist_data = playlist_full.dump(
+        playlist,
+        users=users,
+        tracks=tracks,
+        tracks_counts=load_tracks_counts([playlist])
+    )
+    playlist_data['plays_count'] = (playlist.plays_count or 0) + plays_buffer.pending(playlist_id)
+    
+    return jsonify({
+        'success': True,
+        'playlist': playlist_data
+    }), 200
+
+# Прослушивание плейлиста
+@app.route('/api/playlists/<int:playlist_id>/play', methods=['POST'])
+def api_play_playlist(playlist_id):
+    playlist = db.session.query(Playlist.id, Playlist.plays_count, Playlist.is_public)\
+        .filter_by(id=playlist_id).first()
+    
+    if not playlist or not playlist.is_public:
+        return jsonify({'success': False, 'error': 'Плейлист не найден'}), 404
+    
+    plays_buffer.add(playlist_id, 1)
+    
+    return jsonify({
+        'success': True,
+        'plays_count': (playlist.plays_count or 0) + plays_buffer.pending(playlist_id)
+    }), 200
+
 #Концерты
 @app.route('/api/concerts', methods=['GET'])
+@cached(tags=lambda: ['concerts'])
 def api_get_concerts():
     city = request.args.get('city', None)
     country = request.args.get('country', None)
@@ -507,16 +759,7 @@ def api_get_concerts():
     
     concerts = query.order_by(Concert.date.asc()).all()
     
-    concerts_data = [{
-        'id': concert.id,
-        'artist_name': concert.artist_name,
-        'venue': concert.venue,
-        'city': concert.city,
-        'country': concert.country,
-        'date': concert.date.isoformat(),
-        'ticket_url': concert.ticket_url,
-        'image_url': concert.image_url
-    } for concert in concerts]
+    concerts_data = concert_summary.dump_many(concerts)
     
     return jsonify({
         'success': True,
@@ -526,11 +769,12 @@ def api_get_concerts():
 
 #Курсы
 @app.route('/api/courses', methods=['GET'])
+@cached(tags=lambda: ['courses'])
 def api_get_courses():
     instrument = request.args.get('instrument', None)
     level = request.args.get('level', None)
     
-    query = Course.query
+    query = Course.query.options(defer(Course.description))
     
     if instrument:
         query = query.filter_by(instrument=instrument)
@@ -539,17 +783,7 @@ def api_get_courses():
     
     courses = query.order_by(Course.created_at.desc()).all()
     
-    courses_data = [{
-        'id': course.id,
-        'title': course.title,
-        'description': course.description,
-        'instructor': course.instructor,
-        'instrument': course.instrument,
-        'level': course.level,
-        'price': course.price,
-        'duration': course.duration,
-        'created_at': course.created_at.isoformat()
-    } for course in courses]
+    courses_data = course_summary.dump_many(courses)
     
     return jsonify({
         'success': True,
@@ -565,90 +799,118 @@ def api_search():
     if not query or len(query) < 2:
         return jsonify({'success': False, 'error': 'Запрос должен содержать минимум 2 символа'}), 400
     
+    search_type = request.args.get('type', None)
+    if search_type and search_type not in ('users', 'posts', 'playlists'):
+        return jsonify({'success': False, 'error': 'Неизвестный тип поиска'}), 400
+    
+    limits = {'users': 10, 'posts': 20, 'playlists': 10}
+    if 'per_page' in request.args:
+        limits = {name: get_per_page() for name in limits}
+    
     results = {
         'users': [],
         'posts': [],
         'playlists': []
     }
+    pagination = {}
+    
+    def run(name):
+        page = request.args.get(f'{name}_page', request.args.get('page', 1, type=int), type=int)
+        found, has_more = search(name, query, page=page, per_page=limits[name])
+        pagination[name] = {'page': page, 'has_more': has_more}
+        return found
+    
+    if not search_type or search_type == 'users':
+        users = run('users')
+        users_data = dump_users([user for user, _ in users])
+        for user_data, (_, snippet) in zip(users_data, users):
+            user_data['snippet'] = snippet
+        results['users'] = users_data
+    
+    if not search_type or search_type == 'posts':
+        posts = run('posts')
+        authors = load_post_authors([post for post, _ in posts])
+        
+        results['posts'] = [{
+            **post_summary.dump(post, users=authors),
+            'snippet': snippet
+        } for post, snippet in posts]
+    
+    if not search_type or search_type == 'playlists':
+        playlists = run('playlists')
+        creators = load_playlist_creators([playlist for playlist, _ in playlists])
+        tracks_counts = load_tracks_counts([playlist for playlist, _ in playlists])
+        
+        results['playlists'] = [{
+            **playlist_summary.dump(playlist, users=creators, tracks_counts=tracks_counts),
+            'snippet': snippet
+        } for playlist, snippet in playlists]
     
-    users = User.query.filter(
-        db.or_(
-            User.username.ilike(f'%{query}%'),
-            User.bio.ilike(f'%{query}%')
-        )
-    ).limit(10).all()
-    
-    results['users'] = [user.to_dict() for user in users]
-    
-    posts = Post.query.filter(
-        db.or_(
-            Post.title.ilike(f'%{query}%'),
-            Post.content.ilike(f'%{query}%'),
-            Post.track_name.ilike(f'%{query}%'),
-            Post.artist_name.ilike(f'%{query}%')
-        )
-    ).limit(20).all()
-    
-    results['posts'] = [{
-        'id': post.id,
-        'title': post.title,
-        'content': post.content[:100] + '...' if len(post.content) > 100 else post.content,
-        'author': post.author.to_dict(),
-        'post_type': post.post_type,
-        'created_at': post.created_at.isoformat()
-    } for post in posts]
-    
-    playlists = Playlist.query.filter(
-        db.or_(
-            Playlist.name.ilike(f'%{query}%'),
-            Playlist.description.ilike(f'%{query}%')
-        )
-    ).filter_by(is_public=True).limit(10).all()
+    return jsonify({
+        'success': True,
+        'query': query,
+        'results': results,
+        'pagination': pagination
+    }), 200
+
+@app.route('/api/search/suggest', methods=['GET'])
+def api_search_suggest():
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int), app.config['MAX_PER_PAGE'])
+    kinds = request.args.get('types', None)
     
-    results['playlists'] = [{
-        'id': playlist.id,
-        'name': playlist.name,
-        'description': playlist.description,
-        'creator': playlist.creator.to_dict(),
-        'created_at': playlist.created_at.isoformat()
-    } for playlist in playlists]
+    if not query:
+        return jsonify({'success': True, 'query': query, 'suggestions': []}), 200
     
+    ensure_suggestions()
     return jsonify({
         'success': True,
         'query': query,
-        'results': results
+        'suggestions': suggestions.lookup(query, limit=max(limit, 1), kinds=kinds.split(',') if kinds else None)
+    }), 200
+
+# Метрики кеша ответов
+@app.route('/api/metrics/cache', methods=['GET'])
+def api_cache_metrics():
+    return jsonify({
+        'success': True,
+        'cache': response_cache.stats(),
+        'identity': identities.stats()
+    }), 200
+
+# Состояние реплик для чтения
+@app.route('/api/metrics/replicas', methods=['GET'])
+def api_replicas_metrics():
+    return jsonify({
+        'success': True,
+        **replicas.stats()
+    }), 200
+
+# Открытые потоки уведомлений
+@app.route('/api/metrics/notifications', methods=['GET'])
+def api_notifications_metrics():
+    return jsonify({
+        'success': True,
+        **hub.stats()
+    }), 200
+
+# Метрики буферов счётчиков
+@app.route('/api/metrics/counters', methods=['GET'])
+def api_counters_metrics():
+    return jsonify({
+        'success': True,
+        'buffers': counters_stats()
     }), 200
 
 #Статы
 @app.route('/api/stats', methods=['GET'])
 def api_get_stats():
-    total_users = User.query.count()
-    total_posts = Post.query.count()
-    total_playlists = Playlist.query.filter_by(is_public=True).count()
-    total_comments = Comment.query.count()
-
-    popular_posts = Post.query\
-        .order_by(Post.likes_count.desc())\
-        .limit(5).all()
-    
-    popular_posts_data = [{
-        'id': post.id,
-        'title': post.title,
-        'author': post.author.username,
-        'likes_count': post.likes_count,
-        'comments_count': post.comments_count
-    } for post in popular_posts]
+    snapshot = site_stats.get()
     
-    return jsonify({
-        'success': True,
-        'stats': {
-            'total_users': total_users,
-            'total_posts': total_posts,
-            'total_playlists': total_playlists,
-            'total_comments': total_comments
-        },
-        'popular_posts': popular_posts_data
-    }), 200
+    response = jsonify({'success': True, **snapshot})
+    max_age = max(int(site_stats.interval - site_stats.age()), 0)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return response, 200
 
 # Лайки
 @app.route('/api/posts/<int:post_id>/like', methods=['POST'])
@@ -657,31 +919,42 @@ def api_toggle_like(post_id):
     current_user_id = get_jwt_identity()
     
     try:
-        post = Post.query.get(post_id)
-        if not post:
+        if not db.session.query(Post.id).filter_by(id=post_id).first():
             return jsonify({'success': False, 'error': 'Пост не найден'}), 404
-        from models import PostLike
+        
         existing_like = PostLike.query.filter_by(
             post_id=post_id,
             user_id=current_user_id
         ).first()
         
         if existing_like:
-            db.session.delete(existing_like)
-            post.likes_count -= 1
+            # rowcount защищает от двойного снятия лайка параллельными запросами
+            delta = -PostLike.query.filter_by(id=existing_like.id).delete(synchronize_session=False)
             is_liked = False
         else:
-            like = PostLike(post_id=post_id, user_id=current_user_id)
-            db.session.add(like)
-            post.likes_count += 1
+            # Без SAVEPOINT: на SQLite он открыл бы внешнюю транзакцию, и RELEASE зафиксировал бы
+            # лайк отдельно от счётчика. Повторный лайк параллельного запроса просто не вставится.
+            delta = db.session.execute(ignore_conflicts(PostLike.__table__),
+                                       {'post_id': post_id, 'user_id': current_user_id}).rowcount
+            if delta:
+                post_liked(db.session, post_id, current_user_id)
             is_liked = True
         
+        hot = delta != 0 and hot_posts.hit(post_id)
+        if not hot:
+            change_post_counter(post_id, Post.likes_count, delta)
+        
         db.session.commit()
         
+        if hot:
+            likes_buffer.add(post_id, delta)
+        
+        invalidate(f'post:{post_id}')
+        
         return jsonify({
             'success': True,
             'message': 'Лайк обновлен',
-            'likes_count': post.likes_count,
+            'likes_count': current_likes(post_id),
             'is_liked': is_liked
         }), 200
         
@@ -703,6 +976,10 @@ def api_update_profile():
     if not user:
         return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
     
+    error = bio_error(data.get('bio'))
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
     try:
         allowed_fields = ['bio', 'avatar_url', 'location', 'genres']
         
@@ -717,6 +994,9 @@ def api_update_profile():
         user.updated_at = datetime.now()
         db.session.commit()
         
+        invalidate(f'user:{current_user_id}', 'users')
+        identities.invalidate(current_user_id)
+        
         return jsonify({
             'success': True,
             'message': 'Профиль обновлен',
@@ -728,28 +1008,33 @@ def api_update_profile():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 #Список друзей
+def reverse_follow_exists():
+    reverse = db.aliased(Follow)
+    return db.session.query(reverse.id).filter(
+        reverse.follower_id == Follow.followed_id,
+        reverse.followed_id == Follow.follower_id
+    ).exists()
+
 @app.route('/api/friends', methods=['GET'])
 @jwt_required()
 def api_get_friends():
     current_user_id = get_jwt_identity()
     
-    from models import Follow
-    
-    following = Follow.query.filter_by(follower_id=current_user_id).all()
-    followers = Follow.query.filter_by(followed_id=current_user_id).all()
+    query = Follow.query.filter(Follow.follower_id == current_user_id, reverse_follow_exists())
+    follows, next_cursor = keyset_page(query, Follow, request.args.get('cursor'), get_per_page())
     
-    following_ids = [f.followed_id for f in following]
-    follower_ids = [f.follower_id for f in followers]
-    friend_ids = set(following_ids) & set(follower_ids)
-    friends = User.query.filter(User.id.in_(friend_ids)).all()
+    users = load_users([follow.followed_id for follow in follows])
+    stats = load_user_stats([current_user_id])[current_user_id]
     
     return jsonify({
         'success': True,
-        'friends': [friend.to_dict() for friend in friends],
+        'friends': [users[follow.followed_id] for follow in follows if follow.followed_id in users],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
         'stats': {
-            'friends_count': len(friends),
-            'following_count': len(following),
-            'followers_count': len(followers)
+            'friends_count': stats['friends_count'],
+            'following_count': stats['following_count'],
+            'followers_count': stats['followers_count']
         }
     }), 200
 
@@ -759,24 +1044,21 @@ def api_get_friends():
 def api_get_friend_requests():
     current_user_id = get_jwt_identity()
     
-    from models import Follow
+    query = Follow.query.filter(Follow.followed_id == current_user_id, ~reverse_follow_exists())
+    follows, next_cursor = keyset_page(query, Follow, request.args.get('cursor'), get_per_page())
     
-    followers = Follow.query.filter_by(followed_id=current_user_id).all()
-    following_ids = [f.followed_id for f in Follow.query.filter_by(follower_id=current_user_id).all()]
+    users = load_users([follow.follower_id for follow in follows])
     
-    requests = []
-    for follower in followers:
-        if follower.follower_id not in following_ids:
-            user = User.query.get(follower.follower_id)
-            if user:
-                requests.append({
-                    'user': user.to_dict(),
-                    'requested_at': follower.created_at.isoformat()
-                })
+    requests = [{
+        'user': users[follow.follower_id],
+        'requested_at': follow.created_at.isoformat()
+    } for follow in follows if follow.follower_id in users]
     
     return jsonify({
         'success': True,
-        'requests': requests
+        'requests': requests,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
     }), 200
 
 #Подписка
@@ -810,6 +1092,13 @@ def api_follow_user(user_id):
         
         db.session.commit()
         
+        invalidate(f'user:{current_user_id}', f'user:{user_id}')
+        
+        if action == 'followed':
+            tasks.submit(backfill_follow, current_user_id, user_id)
+        else:
+            tasks.submit(prune_follow, current_user_id, user_id)
+        
         return jsonify({
             'success': True,
             'action': action,
@@ -820,6 +1109,159 @@ def api_follow_user(user_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+#Уведомления
+@app.route('/api/notifications', methods=['GET'])
+@jwt_required()
+def api_get_notifications():
+    current_user_id = get_jwt_identity()
+    
+    query = Notification.query.filter_by(user_id=current_user_id)
+    if request.args.get('unread') in ('1', 'true'):
+        query = query.filter(Notification.is_read.is_(False))
+    notifications, next_cursor = keyset_page(query, Notification, request.args.get('cursor'), get_per_page())
+    
+    return jsonify({
+        'success': True,
+        'notifications': notification_schema.dump_many(notifications),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'unread_count': unread_counts.get(current_user_id)
+    }), 200
+
+@app.route('/api/notifications/unread-count', methods=['GET'])
+@jwt_required()
+def api_notifications_unread_count():
+    return jsonify({
+        'success': True,
+        'unread_count': unread_counts.get(get_jwt_identity())
+    }), 200
+
+@app.route('/api/notifications/read', methods=['POST'])
+@jwt_required()
+def api_mark_notifications_read():
+    """Отметка прочитанными: {"ids": [...]}, {"up_to": id} или {"all": true}"""
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    
+    ids = data.get('ids')
+    up_to = data.get('up_to')
+    if ids is None and up_to is None and not data.get('all'):
+        return jsonify({'success': False, 'error': 'Укажите ids, up_to или all'}), 400
+    if ids is not None and (not isinstance(ids, list) or len(ids) > 1000
+                            or not all(isinstance(i, int) for i in ids)):
+        return jsonify({'success': False, 'error': 'ids должен быть списком (не более 1000 id)'}), 400
+    if up_to is not None and not isinstance(up_to, int):
+        return jsonify({'success': False, 'error': 'up_to должен быть числом'}), 400
+    
+    updated = mark_read(current_user_id, ids=ids, up_to=up_to)
+    
+    return jsonify({
+        'success': True,
+        'updated': updated,
+        'unread_count': unread_counts.get(current_user_id)
+    }), 200
+
+@app.route('/api/notifications/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def api_notifications_stream():
+    """SSE-поток уведомлений; EventSource передаёт токен параметром ?jwt="""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return hub.stream(get_jwt_identity(), last_event_id)
+
+#Сообщения
+@app.route('/api/conversations', methods=['GET'])
+@jwt_required()
+def api_get_conversations():
+    current_user_id = get_jwt_identity()
+    
+    query = Conversation.query.filter_by(user_id=current_user_id)
+    conversations, next_cursor = keyset_page(query, Conversation, request.args.get('cursor'), get_per_page(),
+                                             field='updated_at')
+    users = load_users([conversation.peer_id for conversation in conversations])
+    
+    return jsonify({
+        'success': True,
+        'conversations': conversation_schema.dump_many(conversations, users=users),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'unread_count': unread_total(current_user_id)
+    }), 200
+
+@app.route('/api/conversations/<int:user_id>/messages', methods=['GET'])
+@jwt_required()
+def api_get_messages(user_id):
+    current_user_id = get_jwt_identity()
+    
+    messages, next_cursor = get_history(current_user_id, user_id, request.args.get('cursor'), get_per_page())
+    users = load_users([current_user_id, user_id])
+    
+    return jsonify({
+        'success': True,
+        'messages': message_schema.dump_many(messages, users=users),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }), 200
+
+@app.route('/api/conversations/<int:user_id>/messages', methods=['POST'])
+@jwt_required()
+def api_send_message(user_id):
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({'success': False, 'error': 'Нет данных'}), 400
+    
+    content = data.get('content', '').strip()
+    
+    if not content:
+        return jsonify({'success': False, 'error': 'Сообщение не может быть пустым'}), 400
+    
+    if len(content) > app.config['MESSAGE_MAX_LENGTH']:
+        return jsonify({'success': False, 'error': f"Сообщение длиннее {app.config['MESSAGE_MAX_LENGTH']} символов"}), 400
+    
+    if current_user_id == user_id:
+        return jsonify({'success': False, 'error': 'Нельзя написать самому себе'}), 400
+    
+    if not db.session.query(User.id).filter_by(id=user_id).first():
+        return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
+    
+    try:
+        message = send_message(current_user_id, user_id, content)
+        
+        return jsonify({
+            'success': True,
+            'message': message_schema.dump(message, users=load_users([current_user_id, user_id]))
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/conversations/<int:user_id>/read', methods=['POST'])
+@jwt_required()
+def api_read_conversation(user_id):
+    current_user_id = get_jwt_identity()
+    
+    updated = mark_conversation_read(current_user_id, user_id)
+    
+    return jsonify({
+        'success': True,
+        'updated': updated,
+        'unread_count': unread_total(current_user_id)
+    }), 200
+
+@app.route('/api/messages/unread-count', methods=['GET'])
+@jwt_required()
+def api_messages_unread_count():
+    return jsonify({
+        'success': True,
+        'unread_count': unread_total(get_jwt_identity())
+    }), 200
+
 # Смена пароля
 
 @app.route('/api/auth/change-password', methods=['POST'])
@@ -844,16 +1286,23 @@ def api_change_password():
     if not user:
         return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
     
+    if not user.change_password(current_password, new_password):
+        return jsonify({'success': False, 'error': 'Неверный текущий пароль'}), 400
+    
     try:
-        if user.change_password(current_password, new_password):
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'message': 'Пароль успешно изменен'
-            }), 200
-        else:
-            return jsonify({'success': False, 'error': 'Неверный текущий пароль'}), 400
-            
+        db.session.commit()
+        identities.invalidate(current_user_id)
+        
+        # Все остальные сессии завершаются, текущая получает новые токены
+        blocklist.revoke_all(current_user_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Пароль успешно изменен',
+            'access_token': create_access_token(identity=current_user_id),
+            'refresh_token': create_refresh_token(identity=current_user_id)
+        }), 200
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -885,6 +1334,10 @@ def api_delete_account():
         db.session.delete(user)
         db.session.commit()
         
+        invalidate(f'user:{current_user_id}', 'users', 'posts', 'playlists')
+        identities.invalidate(current_user_id)
+        blocklist.revoke_all(current_user_id)
+        
         return jsonify({
             'success': True,
             'message': 'Аккаунт успешно удален'
@@ -909,4 +1362,5 @@ def serve_frontend(path):
     
     return send_from_directory('static', 'index.html')
 if __name__ == '__main__':
+    bootstrap()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
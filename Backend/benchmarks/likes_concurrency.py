@@ -0,0 +1,75 @@
+"""Проверка точности счётчика лайков при параллельных запросах.
+
+Запуск из каталога Backend:
+    python benchmarks/likes_concurrency.py [пользователей] [потоков]
+
+Каждый пользователь ставит лайк одному посту, часть пользователей затем снимает его.
+В конце posts.likes_count должен совпадать с числом строк post_likes - и в обычном
+режиме (атомарный UPDATE), и в режиме горячего поста (отложенная запись).
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import app, bootstrap  # noqa: E402
+from models import db, User, Post, PostLike  # noqa: E402
+from counters import flush_counters, hot_posts  # noqa: E402
+
+
+def setup(users_count, prefix):
+    with app.app_context():
+        users = [User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', hashed_password='-')
+                 for i in range(users_count)]
+        db.session.add_all(users)
+        db.session.flush()
+        post = Post(title='bench', content='bench', post_type='thought', user_id=users[0].id)
+        db.session.add(post)
+        db.session.commit()
+        tokens = [create_access_token(identity=user.id) for user in users]
+        return post.id, tokens
+
+
+def run(users_count, threads, hot_threshold):
+    hot_posts.threshold = hot_threshold
+    post_id, tokens = setup(users_count, f'bench{hot_threshold}_')
+    client = app.test_client()
+
+    def toggle(token):
+        headers = {'Authorization': f'Bearer {token}'}
+        response = client.post(f'/api/posts/{post_id}/like', headers=headers)
+        assert response.status_code == 200, response.get_json()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(toggle, tokens))
+        list(pool.map(toggle, tokens[::3]))
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        flush_counters()
+        likes = PostLike.query.filter_by(post_id=post_id).count()
+        counter = db.session.get(Post, post_id).likes_count
+
+    mode = 'горячий пост' if hot_threshold else 'атомарный UPDATE'
+    print(f'{mode}: {len(tokens) + len(tokens[::3])} запросов за {elapsed:.2f} с, '
+          f'post_likes={likes}, likes_count={counter}')
+    return likes == counter
+
+
+if __name__ == '__main__':
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    app.config['SUGGEST_REFRESH_SECONDS'] = 0
+    bootstrap()
+
+    ok = run(users_count, threads, hot_threshold=0)
+    ok = run(users_count, threads, hot_threshold=5) and ok
+    print('OK' if ok else 'СЧЁТЧИК РАСХОДИТСЯ')
+    sys.exit(0 if ok else 1)
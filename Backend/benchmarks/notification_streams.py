@@ -0,0 +1,150 @@
+"""Открытые SSE-потоки уведомлений на одном воркере gevent.
+
+Запуск из каталога Backend:
+    python benchmarks/notification_streams.py [потоков] [доставок]
+
+Поднимается gunicorn с одним воркером gevent на временной базе, открывается заданное число
+потоков /api/notifications/stream (по одному на пользователя), затем часть пользователей
+получает подписчика через POST /api/friends/<id>/follow. Выводятся память воркера на поток
+(прирост RSS) и задержка доставки уведомления от отправки запроса до события в потоке.
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+DATABASE = os.path.join(tempfile.mkdtemp(), 'streams.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import app, bootstrap  # noqa: E402
+from models import db, User  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(users):
+    bootstrap()
+    with app.app_context():
+        first = db.session.query(db.func.max(User.id)).scalar() + 1
+        db.session.execute(User.__table__.insert(), [
+            {'id': first + i, 'username': f'stream{i}', 'email': f'stream{i}@example.com', 'hashed_password': '-'}
+            for i in range(users)
+        ])
+        db.session.commit()
+        ids = list(range(first, first + users))
+        return ids, {user_id: create_access_token(identity=user_id) for user_id in ids}
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def worker_pid(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as children:
+        return int(children.read().split()[0])
+
+
+async def http(port, method, path, token):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {token}\r\n'
+                 f'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+
+async def open_stream(port, user_id, token, arrived, ready):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET /api/notifications/stream?jwt={token} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    await writer.drain()
+    connected = False
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'event: unread') and not connected:
+                connected = True
+                ready.append(user_id)
+            elif line.startswith(b'event: notification'):
+                arrived[user_id] = time.perf_counter()
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+async def scenario(port, master_pid, ids, tokens, deliveries):
+    pid = worker_pid(master_pid)
+    await http(port, 'GET', '/api/stats', tokens[ids[0]])
+    base_rss = rss_kib(pid)
+
+    arrived, ready = {}, []
+    streams = [asyncio.create_task(open_stream(port, user_id, tokens[user_id], arrived, ready))
+               for user_id in ids[1:]]
+    deadline = time.time() + 120
+    while len(ready) < len(streams) and time.time() < deadline:
+        await asyncio.sleep(0.5)
+    await asyncio.sleep(1)
+    held_rss = rss_kib(pid)
+    print(f'открыто потоков: {len(ready)} из {len(streams)}')
+    print(f'RSS воркера: {base_rss / 1024:.1f} МиБ -> {held_rss / 1024:.1f} МиБ, '
+          f'{(held_rss - base_rss) / max(len(ready), 1):.1f} КиБ на поток')
+
+    follower = ids[0]
+    sent = {}
+    for user_id in random.sample(ids[1:], deliveries):
+        sent[user_id] = time.perf_counter()
+        await http(port, 'POST', f'/api/friends/{user_id}/follow', tokens[follower])
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(2)
+    latencies = [arrived[user_id] - started for user_id, started in sent.items() if user_id in arrived]
+    print(f'доставлено: {len(latencies)} из {deliveries}, p50 {percentile(latencies, 0.5) * 1000:.1f} мс, '
+          f'p99 {percentile(latencies, 0.99) * 1000:.1f} мс')
+
+    for stream in streams:
+        stream.cancel()
+    await asyncio.gather(*streams, return_exceptions=True)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    deliveries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    ids, tokens = prepare(count + 1)
+
+    port = free_port()
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS='1',
+               GUNICORN_WORKER_CLASS='gevent', GUNICORN_WORKER_CONNECTIONS=str(count + 100))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(3)
+        asyncio.run(scenario(port, process.pid, ids, tokens, deliveries))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Стоимость проверки отзыва JWT на запрос.
+
+Запуск из каталога Backend:
+    python benchmarks/revocation.py [отозванных токенов]
+
+Сравниваются проверка по блоклисту в памяти (фильтр Блума + точное множество) и запрос
+SELECT к таблице revoked_tokens на каждый запрос. Дополнительно выводится доля ложных
+срабатываний фильтра Блума, которые приходится подтверждать по точному множеству.
+"""
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from app import app, bootstrap  # noqa: E402
+from models import db, RevokedToken  # noqa: E402
+from revocation import Blocklist  # noqa: E402
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def main():
+    revoked = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    expires_at = datetime.now() + timedelta(days=1)
+    jtis = [str(uuid.uuid4()) for _ in range(revoked)]
+    bootstrap()
+
+    with app.app_context():
+        db.session.execute(RevokedToken.__table__.insert(), [
+            {'jti': jti, 'user_id': i % 1000 + 1, 'expires_at': expires_at, 'revoked_at': datetime.now()}
+            for i, jti in enumerate(jtis)
+        ])
+        db.session.commit()
+
+        blocklist = Blocklist()
+        blocklist.bloom_bits = app.config['REVOCATION_BLOOM_BITS']
+        blocklist.bloom_hashes = app.config['REVOCATION_BLOOM_HASHES']
+        blocklist.sync()
+
+        valid = {'sub': 1, 'iat': 0, 'jti': str(uuid.uuid4())}
+        revoked_payload = {'sub': 1, 'iat': 0, 'jti': jtis[len(jtis) // 2]}
+        query = RevokedToken.query.filter_by(jti=valid['jti']).exists()
+
+        memory_valid = per_call(lambda: blocklist.is_revoked(valid), 20000)
+        memory_revoked = per_call(lambda: blocklist.is_revoked(revoked_payload), 20000)
+        database = per_call(lambda: db.session.query(query).scalar(), 2000)
+
+        probes = [str(uuid.uuid4()) for _ in range(100000)]
+        false_positives = sum(1 for jti in probes if jti in blocklist._bloom)
+
+    print(f'отозвано токенов: {revoked}')
+    print(f'в памяти, действующий токен: {memory_valid * 1e6:.2f} мкс')
+    print(f'в памяти, отозванный токен:  {memory_revoked * 1e6:.2f} мкс')
+    print(f'SELECT на каждый запрос:     {database * 1e6:.2f} мкс')
+    print(f'ложные срабатывания Блума:   {false_positives / len(probes):.4%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Сравнение сериализации страницы из 100 постов: до и после serializers.py.
+
+Запуск из каталога Backend:
+    python benchmarks/serialization.py [повторов]
+
+"До" - словарь на каждый пост с isoformat() и stdlib json.dumps с настройками
+DefaultJSONProvider Flask (sort_keys, ensure_ascii). "После" - схема post_summary
+и кодировщик serializers.dumps (orjson, если установлен).
+Для каждого варианта выводится время на страницу и объём памяти, выделенной за один вызов.
+"""
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Post  # noqa: E402
+import serializers  # noqa: E402
+
+
+def make_page(size=100):
+    now = datetime.now()
+    users = {user_id: {
+        'id': user_id,
+        'username': f'user{user_id}',
+        'email': f'user{user_id}@example.com',
+        'bio': 'Слушаю джаз и пост-рок',
+        'avatar_url': None,
+        'location': 'Москва',
+        'website': None,
+        'genres': ['jazz', 'post-rock'],
+        'is_verified': False,
+        'created_at': now.isoformat(),
+        'last_login': None,
+        'stats': {'posts_count': 12, 'followers_count': 40, 'following_count': 31,
+                  'friends_count': 20, 'playlists_count': 3, 'reviews_count': 5},
+    } for user_id in range(1, 21)}
+    posts = [Post(
+        id=i,
+        title=f'Пост номер {i}',
+        content='Текст поста о музыке. ' * 20,
+        post_type='thought',
+        user_id=i % 20 + 1,
+        track_name='Track',
+        artist_name='Artist',
+        created_at=now - timedelta(minutes=i),
+        likes_count=i * 3,
+        comments_count=i,
+    ) for i in range(size)]
+    return posts, users
+
+
+def legacy(posts, users):
+    data = [{
+        'id': post.id,
+        'title': post.title,
+        'content': post.content[:200] + '...' if len(post.content) > 200 else post.content,
+        'author': users.get(post.user_id),
+        'post_type': post.post_type,
+        'track_name': post.track_name,
+        'artist_name': post.artist_name,
+        'created_at': post.created_at.isoformat(),
+        'likes_count': post.likes_count,
+        'comments_count': post.comments_count
+    } for post in posts]
+    return json.dumps({'success': True, 'posts': data}, ensure_ascii=True, sort_keys=True).encode()
+
+
+def current(posts, users):
+    data = serializers.post_summary.dump_many(posts, users=users)
+    return serializers.dumps({'success': True, 'posts': data})
+
+
+def allocated(fn, *args):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - before
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    posts, users = make_page()
+    encoder = 'orjson' if serializers.orjson is not None else 'json'
+
+    assert json.loads(legacy(posts, users)) == json.loads(current(posts, users))
+
+    results = {}
+    for name, fn in (('до', legacy), (f'после ({encoder})', current)):
+        seconds = min(timeit.repeat(lambda: fn(posts, users), number=repeat, repeat=3)) / repeat
+        results[name] = seconds
+        print(f'{name:>16}: {seconds * 1000:.3f} мс на страницу, '
+              f'{allocated(fn, posts, users) / 1024:.1f} КиБ памяти, '
+              f'{len(fn(posts, users))} байт ответа')
+
+    before, after = results.values()
+    print(f'ускорение: x{before / after:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Нагрузочный тест режимов gunicorn: sync-воркеры против gevent.
+
+Запуск из каталога Backend:
+    python benchmarks/serving.py [секунд на уровень] [клиенты через запятую]
+
+Для каждого режима поднимается gunicorn с gunicorn.conf.py на временной базе SQLite
+(flask bootstrap + 300 постов), кеш ответов выключен, чтобы запросы доходили до базы.
+Клиенты (asyncio, по соединению на запрос) непрерывно шлют смесь запросов: ленты постов,
+карточки постов и профилей, подсказки поиска и 5% входов с проверкой пароля.
+Выводятся пропускная способность, p50/p99 задержки и число ошибок (таймаут 30 с,
+отказ в соединении, ответ 5xx) на 50/200/1000 одновременных клиентах.
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from models import Post  # noqa: E402
+
+POSTS = 300
+REQUEST_TIMEOUT = 30
+# Меньшая стоимость хеша, чтобы входы не занимали весь CPU тестовой машины
+HASH_METHOD = 'pbkdf2:sha256:60000'
+
+MODES = (
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_WORKERS': '4'}),
+    ('gevent', {'GUNICORN_WORKER_CLASS': 'gevent', 'GUNICORN_WORKERS': '4',
+                'GUNICORN_WORKER_CONNECTIONS': '1000'}),
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(env, path):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=BACKEND, env=env,
+                   capture_output=True, check=True)
+    engine = create_engine(f'sqlite:///{path}')
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(Post.__table__.insert(), [
+            {'title': f'post {i}', 'content': 'text ' * 100, 'excerpt': 'text', 'post_type': 'thought',
+             'user_id': 1, 'created_at': now, 'updated_at': now, 'likes_count': 0, 'comments_count': 0,
+             'views_count': 0}
+            for i in range(POSTS)
+        ])
+    engine.dispose()
+
+
+def request_bytes():
+    roll = random.random()
+    if roll < 0.05:
+        body = b'{"email": "admin@musblossom.com", "password": "admin123"}'
+        return (b'POST /api/auth/login HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n'
+                b'Content-Type: application/json\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+    if roll < 0.45:
+        path = f'/api/posts?page={random.randint(1, 30)}'
+    elif roll < 0.75:
+        path = f'/api/posts/{random.randint(1, POSTS)}'
+    elif roll < 0.9:
+        path = f'/api/users/{random.randint(1, 2)}'
+    else:
+        path = f'/api/search/suggest?q={random.choice("apt")}'
+    return f'GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode()
+
+
+async def one_request(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(request_bytes())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def client(port, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(one_request(port), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            errors.append(1)
+            continue
+        if status >= 500:
+            errors.append(1)
+        else:
+            latencies.append(time.perf_counter() - started)
+
+
+async def load(port, clients, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, deadline, latencies, errors) for _ in range(clients)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def wait_ready(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn завершился при запуске')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+                sock.sendall(b'GET /api/stats HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n')
+                if sock.recv(64).startswith(b'HTTP/1.1 200'):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('gunicorn не ответил')
+
+
+def run_mode(name, settings, base_env, levels, duration):
+    port = free_port()
+    env = dict(base_env, GUNICORN_BIND=f'127.0.0.1:{port}', **settings)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port, process)
+        print(name)
+        for clients in levels:
+            latencies, errors = asyncio.run(load(port, clients, duration))
+            print(f'  {clients:5} клиентов: {len(latencies) / duration:7.1f} запр/с, '
+                  f'p50 {percentile(latencies, 0.5) * 1000:7.1f} мс, p99 {percentile(latencies, 0.99) * 1000:8.1f} мс, '
+                  f'ошибок {len(errors)}')
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 15
+    levels = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [50, 200, 1000]
+    path = os.path.join(tempfile.mkdtemp(), 'serving.db')
+    base_env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', RESPONSE_CACHE='none',
+                    PASSWORD_HASH_METHOD=HASH_METHOD, GUNICORN_TIMEOUT='120')
+    prepare(base_env, path)
+    for name, settings in MODES:
+        run_mode(name, settings, base_env, levels, duration)
+
+
+if __name__ == '__main__':
+    main()
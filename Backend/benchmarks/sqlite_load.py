@@ -0,0 +1,129 @@
+"""Нагрузочный тест SQLite: параллельные чтения и записи из нескольких процессов.
+
+Запуск из каталога Backend:
+    python benchmarks/sqlite_load.py [секунд] [писателей] [читателей]
+
+Процессы имитируют воркеры gunicorn: писатели в одной транзакции увеличивают likes_count
+и добавляют комментарий, читатели выбирают страницу постов с числом комментариев.
+Прогон выполняется дважды на отдельных файлах - с прежними настройками (журнал DELETE,
+без PRAGMA) и с профилем из Config.SQLITE_PRAGMAS / SQLALCHEMY_ENGINE_OPTIONS.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func, select, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from config import Config  # noqa: E402
+from database import apply_pragmas  # noqa: E402
+from models import db, User, Post, Comment  # noqa: E402
+
+POSTS = 200
+
+
+def make_engine(path, tuned):
+    if not tuned:
+        return create_engine(f'sqlite:///{path}')
+    engine = create_engine(f'sqlite:///{path}', **Config.SQLALCHEMY_ENGINE_OPTIONS)
+    event.listen(engine, 'connect', lambda connection, record: apply_pragmas(connection, Config.SQLITE_PRAGMAS))
+    return engine
+
+
+def prepare(path, tuned):
+    engine = make_engine(path, tuned)
+    db.metadata.create_all(engine)
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert().values(
+            id=1, username='load', email='load@example.com', hashed_password='-'))
+        connection.execute(Post.__table__.insert(), [
+            {'title': f'post {i}', 'content': 'text', 'post_type': 'thought', 'user_id': 1,
+             'created_at': now, 'likes_count': 0, 'comments_count': 0}
+            for i in range(POSTS)
+        ])
+    engine.dispose()
+
+
+def writer(connection):
+    post_id = random.randint(1, POSTS)
+    with connection.begin():
+        connection.execute(text(
+            'UPDATE posts SET likes_count = likes_count + 1, comments_count = comments_count + 1 WHERE id = :id'
+        ), {'id': post_id})
+        connection.execute(Comment.__table__.insert().values(
+            content='load', user_id=1, post_id=post_id, created_at=datetime.now()))
+
+
+def reader(connection):
+    with connection.begin():
+        posts = connection.execute(
+            select(Post.id, Post.title, Post.likes_count)
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(20)
+        ).all()
+        connection.execute(
+            select(Comment.post_id, func.count())
+            .where(Comment.post_id.in_([post.id for post in posts]))
+            .group_by(Comment.post_id)
+        ).all()
+
+
+def worker(args):
+    path, tuned, role, duration = args
+    engine = make_engine(path, tuned)
+    operation = writer if role == 'write' else reader
+    latencies = []
+    errors = 0
+    deadline = time.time() + duration
+    with engine.connect() as connection:
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                operation(connection)
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                errors += 1
+    engine.dispose()
+    return role, latencies, errors
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(tuned, duration, writers, readers):
+    path = os.path.join(tempfile.mkdtemp(), 'load.db')
+    prepare(path, tuned)
+    jobs = [(path, tuned, 'write', duration)] * writers + [(path, tuned, 'read', duration)] * readers
+    with multiprocessing.get_context('fork').Pool(len(jobs)) as pool:
+        results = pool.map(worker, jobs)
+
+    print('профиль Config' if tuned else 'без настроек (журнал DELETE)')
+    for role in ('write', 'read'):
+        latencies = [value for r, values, _ in results if r == role for value in values]
+        errors = sum(e for r, _, e in results if r == role)
+        print(f'  {"записи" if role == "write" else "чтения"}: {len(latencies) / duration:8.1f} оп/с, '
+              f'p50 {percentile(latencies, 0.5) * 1000:6.2f} мс, p95 {percentile(latencies, 0.95) * 1000:7.2f} мс, '
+              f'ошибок "database is locked": {errors}')
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    run(False, duration, writers, readers)
+    run(True, duration, writers, readers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Время запуска воркера: от импорта app до первого обслуженного запроса.
+
+Запуск из каталога Backend:
+    python benchmarks/startup.py [повторов]
+
+Каждый замер идёт в отдельном процессе на заранее подготовленной базе (flask bootstrap).
+Сравниваются текущий запуск (импорт без обращений к базе) и прежний, когда при импорте
+выполнялись create_all, миграции и проверка начальных данных. Третий вариант - gunicorn --preload:
+приложение уже импортировано в мастере, замеряется fork воркера и его первый ответ.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, os, sys, time
+if sys.argv[1] == 'preload':
+    from app import app
+    read_end, write_end = os.pipe()
+    started = time.perf_counter()
+    if os.fork() == 0:
+        forked = time.perf_counter()
+        response = app.test_client().get('/api/posts')
+        served = time.perf_counter()
+        assert response.status_code == 200, response.status_code
+        os.write(write_end, json.dumps({'import': 0, 'ready': forked - started,
+                                        'first_request': served - started}).encode())
+        os._exit(0)
+    os.wait()
+    print(os.read(read_end, 4096).decode())
+    sys.exit()
+
+started = time.perf_counter()
+from app import app, bootstrap
+imported = time.perf_counter()
+if sys.argv[1] == 'bootstrap':
+    from suggest import build_suggestions
+    bootstrap()
+    with app.app_context():
+        build_suggestions()
+ready = time.perf_counter()
+response = app.test_client().get('/api/posts')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - started, 'ready': ready - started, 'first_request': served - started}))
+'''
+
+
+def probe(mode, env):
+    output = subprocess.run([sys.executable, '-c', PROBE, mode], cwd=BACKEND, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db'))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=BACKEND, env=env,
+                   capture_output=True, check=True)
+
+    for mode, title in (('bootstrap', 'bootstrap при импорте (прежнее поведение)'),
+                        ('import', 'импорт без обращений к базе'),
+                        ('preload', 'fork воркера из мастера с --preload')):
+        runs = [probe(mode, env) for _ in range(repeats)]
+        print(title)
+        for key, label in (('import', 'импорт app'), ('ready', 'готов к запросам'),
+                           ('first_request', 'первый ответ')):
+            print(f'  {label:18} {statistics.median(run[key] for run in runs) * 1000:8.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, current_app
+
+# Кеш ответов публичных GET-эндпоинтов для анонимных посетителей.
+# Ключ - эндпоинт + аргументы URL + нормализованные query-параметры.
+# Записи помечаются тегами ('posts', 'post:5', 'user:3', ...) и сбрасываются обработчиками
+# записи через invalidate(...) после коммита. Список постов дополнительно помечается post:<id>
+# каждого поста страницы (tag_response), поэтому лайк или комментарий сбрасывает и его.
+# Бэкенды: 'memory' - LRU с TTL в памяти воркера, 'disk' - общий для всех воркеров файл SQLite.
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires, value, tags)
+        self._tags = {}                 # tag -> set(key)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, tags):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, set()):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class DiskBackend:
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY, expires REAL NOT NULL,
+                    status INTEGER NOT NULL, mimetype TEXT, body BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));
+                CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires);
+                CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key);
+            ''')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT status, mimetype, body FROM cache WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return (row[2], row[0], row[1]) if row else None
+
+    def set(self, key, value, ttl, tags):
+        body, status, mimetype = value
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, expires, status, mimetype, body) VALUES (?, ?, ?, ?, ?)',
+                (key, time.time() + ttl, status, mimetype, body)
+            )
+            connection.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            connection.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                                   [(tag, key) for tag in tags])
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._purge()
+
+    def invalidate(self, tags):
+        connection = self._connect()
+        placeholders = ', '.join('?' for _ in tags)
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                f'DELETE FROM cache WHERE key IN (SELECT key FROM cache_tags WHERE tag IN ({placeholders}))',
+                list(tags)
+            )
+            connection.execute(f'DELETE FROM cache_tags WHERE tag IN ({placeholders})', list(tags))
+
+    def clear(self):
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM cache')
+            connection.execute('DELETE FROM cache_tags')
+
+    def _purge(self):
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            connection.execute('DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache)')
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.ttl = 30
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def init_app(self, app):
+        kind = app.config['RESPONSE_CACHE']
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        if kind == 'memory':
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_SIZE'])
+        elif kind == 'disk':
+            path = app.config['RESPONSE_CACHE_PATH'] or os.path.join(app.instance_path, 'response_cache.db')
+            self.backend = DiskBackend(path, app.config['RESPONSE_CACHE_SIZE'])
+        else:
+            self.backend = None
+
+    def key(self):
+        args = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+        view_args = ','.join(f'{name}={value}' for name, value in sorted((request.view_args or {}).items()))
+        return f'{request.endpoint}|{view_args}|{args}'
+
+    def invalidate(self, *tags):
+        if self.backend is None or not tags:
+            return
+        try:
+            self.backend.invalidate(tags)
+        except Exception as e:
+            current_app.logger.warning('Не удалось сбросить кеш %s: %s', tags, e)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+            'miss_ratio': round(self.misses / lookups, 4) if lookups else 0,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def invalidate(*tags):
+    response_cache.invalidate(*tags)
+
+
+def tag_response(*tags):
+    """Теги, известные только после выборки (например, post:<id> постов страницы)"""
+    g.setdefault('cache_tags', []).extend(tags)
+
+
+def cached(tags):
+    """Кеширование ответа view для анонимных GET-запросов.
+
+    tags - функция от аргументов view, возвращающая список тегов записи.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = response_cache
+            if cache.backend is None or request.method != 'GET' or 'Authorization' in request.headers:
+                cache.bypasses += 1
+                return current_app.make_response(fn(*args, **kwargs))
+
+            key = cache.key()
+            try:
+                entry = cache.backend.get(key)
+            except Exception as e:
+                current_app.logger.warning('Ошибка чтения кеша: %s', e)
+                entry = None
+
+            if entry is not None:
+                cache.hits += 1
+                body, status, mimetype = entry
+                response = current_app.response_class(body, status=status, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            cache.misses += 1
+            g.pop('cache_tags', None)
+            response = current_app.make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                try:
+                    cache.backend.set(key, (response.get_data(), response.status_code, response.mimetype),
+                                      cache.ttl, list(tags(*args, **kwargs)) + g.pop('cache_tags', []))
+                except Exception as e:
+                    current_app.logger.warning('Ошибка записи кеша: %s', e)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
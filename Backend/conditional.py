@@ -0,0 +1,90 @@
+import hashlib
+
+from flask import request, current_app
+from sqlalchemy import func
+
+from models import db, User, UserStats, Post, Playlist, PlaylistTrack
+
+# Условные GET-запросы (ETag / Last-Modified).
+# Валидаторы строятся из updated_at и счётчиков, которые читаются лёгким запросом по нескольким
+# колонкам - до загрузки связей и сериализации. Если клиент прислал совпадающий If-None-Match
+# (или, без него, If-Modified-Since не раньше Last-Modified), сразу отвечаем 304.
+# Last-Modified отражает только правку содержимого; изменения счётчиков видны через ETag,
+# а If-None-Match по RFC 7232 имеет приоритет над If-Modified-Since.
+
+
+class Validators:
+    def __init__(self, kind, object_id, updated_at, *parts):
+        raw = '|'.join(str(part) for part in (kind, object_id, updated_at.isoformat() if updated_at else '', *parts))
+        self.etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+        # updated_at хранится в локальном времени сервера без зоны
+        self.last_modified = updated_at.replace(microsecond=0).astimezone() if updated_at else None
+
+    def matches(self):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since and self.last_modified:
+            return self.last_modified <= request.if_modified_since
+        return False
+
+    def apply(self, response):
+        response.set_etag(self.etag, weak=True)
+        if self.last_modified:
+            response.last_modified = self.last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def not_modified(self):
+        response = current_app.response_class(status=304)
+        return self.apply(response)
+
+
+def conditional(validators, render):
+    """304, если клиентская копия актуальна, иначе render() с проставленными валидаторами"""
+    if validators.matches():
+        return validators.not_modified()
+    response = current_app.make_response(render())
+    if response.status_code == 200:
+        validators.apply(response)
+    return response
+
+
+def post_validators(post_id):
+    row = db.session.query(Post.updated_at, Post.likes_count, Post.comments_count, User.updated_at)\
+        .join(User, User.id == Post.user_id)\
+        .filter(Post.id == post_id)\
+        .first()
+    if row is None:
+        return None
+    updated_at, likes_count, comments_count, author_updated_at = row
+    return Validators('post', post_id, max(filter(None, [updated_at, author_updated_at]), default=None),
+                      likes_count, comments_count)
+
+
+def user_validators(user_id):
+    row = db.session.query(User.updated_at, UserStats)\
+        .outerjoin(UserStats, UserStats.user_id == User.id)\
+        .filter(User.id == user_id)\
+        .first()
+    if row is None:
+        return None
+    updated_at, stats = row
+    counters = sorted(stats.to_dict().items()) if stats else ()
+    return Validators('user', user_id, updated_at, *counters)
+
+
+def playlist_validators(playlist_id):
+    """(валидаторы, is_public, user_id) или None"""
+    row = db.session.query(
+        Playlist.updated_at, Playlist.is_public, Playlist.user_id,
+        func.count(PlaylistTrack.id), func.max(PlaylistTrack.added_at)
+    ).outerjoin(PlaylistTrack, PlaylistTrack.playlist_id == Playlist.id)\
+        .filter(Playlist.id == playlist_id)\
+        .group_by(Playlist.id)\
+        .first()
+    if row is None:
+        return None
+    updated_at, is_public, user_id, tracks_count, last_added_at = row
+    validators = Validators('playlist', playlist_id, max(filter(None, [updated_at, last_added_at]), default=None),
+                            tracks_count)
+    return validators, is_public, user_id
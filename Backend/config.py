@@ -5,10 +5,91 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///musblossom.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Пул соединений; для SQLite в памяти не используется
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+    }
+    # Пул под gevent (см. serving.py): число соединений ограничено жёстко, ожидание свободного
+    # соединения не блокирует воркер. Ожидание блокировки SQLite (busy_timeout) идёт внутри
+    # драйвера и останавливает все гринлеты воркера, поэтому под gevent оно короче.
+    GEVENT_DB_POOL_SIZE = int(os.environ.get('GEVENT_DB_POOL_SIZE', 10))
+    GEVENT_DB_POOL_TIMEOUT = 30
+    GEVENT_SQLITE_BUSY_TIMEOUT = int(os.environ.get('GEVENT_SQLITE_BUSY_TIMEOUT', 1000))
+    # Реплики для чтения (через запятую); пусто - всё идёт в основную базу
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    REPLICA_HEALTH_SECONDS = 5
+    # Копирование основной SQLite-базы в реплики через backup API (для локальной проверки)
+    REPLICA_SQLITE_SYNC_SECONDS = int(os.environ.get('REPLICA_SQLITE_SYNC_SECONDS', 0))
+    # PRAGMA для каждого нового соединения SQLite
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+        'temp_store': 'MEMORY',
+    }
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'your-jwt-secret-key-here'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     
+    DEFAULT_PER_PAGE = 10
+    MAX_PER_PAGE = int(os.environ.get('MAX_PER_PAGE', 50))
+    
+    BACKGROUND_TASKS = True
+    
+    COUNTER_FLUSH_INTERVAL = int(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+    COUNTER_FLUSH_MAX_PENDING = 1000
+    LIKES_HOT_WINDOW = 10
+    LIKES_HOT_THRESHOLD = int(os.environ.get('LIKES_HOT_THRESHOLD', 20))
+    
+    FEED_FANOUT_LIMIT = int(os.environ.get('FEED_FANOUT_LIMIT', 5000))
+    FEED_FANOUT_BATCH = 500
+    FEED_BACKFILL = 50
+    
+    # memory | disk | none; в docker-compose.prod.yml - disk, общий для всех воркеров gunicorn
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))
+    RESPONSE_CACHE_SIZE = 1024
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    
+    STATS_REFRESH_SECONDS = int(os.environ.get('STATS_REFRESH_SECONDS', 60))
+    
+    SUGGEST_LIMIT = 8
+    SUGGEST_REFRESH_SECONDS = int(os.environ.get('SUGGEST_REFRESH_SECONDS', 300))
+    
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+    IDENTITY_CACHE_SIZE = 10000
+    
+    REVOCATION_SYNC_SECONDS = int(os.environ.get('REVOCATION_SYNC_SECONDS', 2))
+    REVOCATION_BLOOM_BITS = 1 << 20
+    REVOCATION_BLOOM_HASHES = 7
+    
+    NOTIFICATIONS_POLL_SECONDS = int(os.environ.get('NOTIFICATIONS_POLL_SECONDS', 2))
+    NOTIFICATIONS_HEARTBEAT_SECONDS = 15
+    NOTIFICATIONS_STREAM_SECONDS = int(os.environ.get('NOTIFICATIONS_STREAM_SECONDS', 300))
+    NOTIFICATIONS_SYNC_RETRY_MS = int(os.environ.get('NOTIFICATIONS_SYNC_RETRY_MS', 10000))
+    NOTIFICATIONS_RETRY_MS = 3000
+    NOTIFICATIONS_BATCH = 100
+    NOTIFICATIONS_UNREAD_TTL = int(os.environ.get('NOTIFICATIONS_UNREAD_TTL', 30))
+    NOTIFICATIONS_UNREAD_CACHE_SIZE = 10000
+    
+    MESSAGE_MAX_LENGTH = 2000
+    BIO_MAX_LENGTH = 500
+    
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    # Одновременных хешей на весь сервер; при 4 sync-воркерах хотя бы один остаётся для API
+    PASSWORD_HASH_SLOTS = int(os.environ.get('PASSWORD_HASH_SLOTS', 3))
+    PASSWORD_HASH_SLOTS_PATH = os.environ.get('PASSWORD_HASH_SLOTS_PATH')
+    PASSWORD_HASH_TIMEOUT = 10
+    
     CORS_ORIGINS = ['http://localhost:5173', 'http://127.0.0.1:5173', 'http://localhost:8080']
     
 class DevelopmentConfig(Config):
@@ -0,0 +1,311 @@
+import atexit
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, select, and_, bindparam
+
+from models import db, User, UserStats, Post, Playlist, Review, Follow
+from tasks import run_periodically
+
+# Денормализованные счётчики пользователя (таблица user_stats).
+# Обновляются атомарными UPDATE в той же транзакции, что и запись Post/Follow/Playlist/Review,
+# поэтому User.to_dict() больше не считает их заново на каждый запрос.
+
+stats_table = UserStats.__table__
+follows_table = Follow.__table__
+
+
+def _friends_query(user_id):
+    reverse = follows_table.alias('reverse')
+    return select(func.count()).select_from(
+        follows_table.join(reverse, and_(
+            reverse.c.follower_id == follows_table.c.followed_id,
+            reverse.c.followed_id == follows_table.c.follower_id,
+        ))
+    ).where(follows_table.c.follower_id == user_id)
+
+
+def _count_user(connection, user_id):
+    def count(column):
+        return connection.execute(
+            select(func.count()).where(column == user_id)
+        ).scalar()
+
+    return {
+        'posts_count': count(Post.__table__.c.user_id),
+        'followers_count': count(follows_table.c.followed_id),
+        'following_count': count(follows_table.c.follower_id),
+        'friends_count': connection.execute(_friends_query(user_id)).scalar(),
+        'playlists_count': count(Playlist.__table__.c.user_id),
+        'reviews_count': count(Review.__table__.c.user_id),
+    }
+
+
+def bump(connection, user_id, **deltas):
+    values = {name: getattr(stats_table.c, name) + delta for name, delta in deltas.items()}
+    result = connection.execute(
+        stats_table.update().where(stats_table.c.user_id == user_id).values(**values)
+    )
+    if result.rowcount == 0:
+        # Строки ещё нет (пользователь создан до появления счётчиков) - пересчитываем целиком
+        connection.execute(stats_table.insert().values(user_id=user_id, **_count_user(connection, user_id)))
+
+
+def _is_mutual(connection, follow):
+    return connection.execute(
+        select(follows_table.c.id).where(and_(
+            follows_table.c.follower_id == follow.followed_id,
+            follows_table.c.followed_id == follow.follower_id,
+        ))
+    ).first() is not None
+
+
+@event.listens_for(User, 'after_insert')
+def _user_created(mapper, connection, user):
+    connection.execute(stats_table.insert().values(user_id=user.id))
+
+
+@event.listens_for(User, 'before_delete')
+def _user_deleted(mapper, connection, user):
+    connection.execute(stats_table.delete().where(stats_table.c.user_id == user.id))
+
+
+def _track(model, field):
+    @event.listens_for(model, 'after_insert')
+    def created(mapper, connection, target):
+        bump(connection, target.user_id, **{field: 1})
+
+    @event.listens_for(model, 'after_delete')
+    def deleted(mapper, connection, target):
+        bump(connection, target.user_id, **{field: -1})
+
+
+_track(Post, 'posts_count')
+_track(Playlist, 'playlists_count')
+_track(Review, 'reviews_count')
+
+
+@event.listens_for(Follow, 'after_insert')
+def _follow_created(mapper, connection, follow):
+    friends = 1 if _is_mutual(connection, follow) else 0
+    bump(connection, follow.follower_id, following_count=1, friends_count=friends)
+    bump(connection, follow.followed_id, followers_count=1, friends_count=friends)
+
+
+@event.listens_for(Follow, 'before_delete')
+def _follow_deleting(mapper, connection, follow):
+    # before_delete вызывается для всех подписок пачки до общего DELETE, поэтому обратная
+    # подписка здесь ещё видна, даже если каскад удаления аккаунта убирает обе
+    follow._was_mutual = _is_mutual(connection, follow)
+
+
+@event.listens_for(Follow, 'after_delete')
+def _follow_deleted(mapper, connection, follow):
+    mutual = getattr(follow, '_was_mutual', False)
+    if mutual and not _is_mutual(connection, follow) and follow.follower_id > follow.followed_id:
+        # Обе стороны дружбы удалены одним flush: пару учитывает подписка с меньшим follower_id
+        mutual = False
+    friends = -1 if mutual else 0
+    bump(connection, follow.follower_id, following_count=-1, friends_count=friends)
+    bump(connection, follow.followed_id, followers_count=-1, friends_count=friends)
+
+
+def rebuild_user_stats():
+    """Полный пересчёт user_stats сгруппированными запросами"""
+    def grouped(column):
+        return dict(db.session.query(column, func.count()).group_by(column).all())
+
+    reverse = db.aliased(Follow)
+    friends = dict(
+        db.session.query(Follow.follower_id, func.count())
+        .join(reverse, and_(reverse.follower_id == Follow.followed_id,
+                            reverse.followed_id == Follow.follower_id))
+        .group_by(Follow.follower_id)
+        .all()
+    )
+    posts = grouped(Post.user_id)
+    followers = grouped(Follow.followed_id)
+    following = grouped(Follow.follower_id)
+    playlists = grouped(Playlist.user_id)
+    reviews = grouped(Review.user_id)
+
+    rows = [{
+        'user_id': user_id,
+        'posts_count': posts.get(user_id, 0),
+        'followers_count': followers.get(user_id, 0),
+        'following_count': following.get(user_id, 0),
+        'friends_count': friends.get(user_id, 0),
+        'playlists_count': playlists.get(user_id, 0),
+        'reviews_count': reviews.get(user_id, 0),
+    } for (user_id,) in db.session.query(User.id).all()]
+
+    db.session.execute(stats_table.delete())
+    if rows:
+        db.session.execute(stats_table.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+# Счётчики постов и плейлистов.
+# Лайки: обычный путь - атомарный UPDATE posts SET likes_count = likes_count + 1 в транзакции запроса.
+# Для "горячих" постов (много лайков за короткое окно в этом воркере) дельты копятся в памяти
+# и сбрасываются одним пакетным UPDATE, чтобы писатели не выстраивались в очередь за строкой поста.
+# Просмотры и прослушивания всегда идут через буфер: раз в COUNTER_FLUSH_INTERVAL секунд,
+# при переполнении и при остановке воркера.
+
+
+class CounterBuffer:
+    def __init__(self, column):
+        self.column = column
+        self.table = column.table
+        self.flush_interval = 5
+        self.max_pending = 1000
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest = None
+        self._last_flush = time.time()
+        self.flushed_rows = 0
+        self.flush_errors = 0
+
+    def add(self, row_id, delta):
+        with self._lock:
+            self._pending[row_id] = self._pending.get(row_id, 0) + delta
+            if self._oldest is None:
+                self._oldest = time.time()
+            due = len(self._pending) >= self.max_pending or \
+                time.time() - self._last_flush >= self.flush_interval
+        if due:
+            # Сбой записи пачки не должен ронять запрос, который лишь добавил дельту: дельты уже
+            # возвращены в буфер, их запишет следующий сброс (ошибку видит flush_counters)
+            try:
+                self.flush()
+            except Exception as e:
+                current_app.logger.warning('Не удалось сбросить счётчики %s.%s: %s',
+                                           self.table.name, self.column.name, e)
+
+    def pending(self, row_id):
+        return self._pending.get(row_id, 0)
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            oldest, self._oldest = self._oldest, None
+            self._last_flush = time.time()
+        rows = [{'row_id': row_id, 'delta': delta} for row_id, delta in batch.items() if delta]
+        if not rows:
+            return 0
+
+        # updated_at оставляем как есть: счётчики не меняют содержимое
+        statement = self.table.update()\
+            .where(self.table.c.id == bindparam('row_id'))\
+            .values({self.column.name: self.column + bindparam('delta'),
+                     'updated_at': self.table.c.updated_at})
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, rows)
+        except Exception:
+            # Возвращаем дельты, чтобы не потерять их до следующей попытки
+            with self._lock:
+                for row in rows:
+                    self._pending[row['row_id']] = self._pending.get(row['row_id'], 0) + row['delta']
+                self._oldest = min(filter(None, [oldest, self._oldest]), default=None)
+                self.flush_errors += 1
+            raise
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'column': f'{self.table.name}.{self.column.name}',
+                'pending_rows': len(self._pending),
+                'pending_total': sum(self._pending.values()),
+                'lag_seconds': round(now - self._oldest, 3) if self._oldest else 0,
+                'since_last_flush_seconds': round(now - self._last_flush, 3),
+                'flushed_rows': self.flushed_rows,
+                'flush_errors': self.flush_errors,
+            }
+
+
+class HotKeys:
+    """Определение горячих ключей по числу обращений за окно"""
+
+    def __init__(self):
+        self.window = 10
+        self.threshold = 20
+        self._lock = threading.Lock()
+        self._hits = {}
+
+    def hit(self, key):
+        now = time.time()
+        with self._lock:
+            started, count = self._hits.get(key, (now, 0))
+            if now - started > self.window:
+                started, count = now, 0
+            self._hits[key] = (started, count + 1)
+            if len(self._hits) > 10000:
+                self._hits = {k: v for k, v in self._hits.items() if now - v[0] <= self.window}
+            return self.threshold > 0 and count + 1 >= self.threshold
+
+
+likes_buffer = CounterBuffer(Post.__table__.c.likes_count)
+views_buffer = CounterBuffer(Post.__table__.c.views_count)
+plays_buffer = CounterBuffer(Playlist.__table__.c.plays_count)
+hot_posts = HotKeys()
+buffers = [likes_buffer, views_buffer, plays_buffer]
+
+
+def change_post_counter(post_id, column, delta):
+    """Атомарное изменение счётчика поста в текущей транзакции"""
+    if delta:
+        Post.query.filter_by(id=post_id)\
+            .update({column: column + delta, Post.updated_at: Post.updated_at}, synchronize_session=False)
+
+
+def current_likes(post_id):
+    value = db.session.query(Post.likes_count).filter_by(id=post_id).scalar() or 0
+    return value + likes_buffer.pending(post_id)
+
+
+def flush_counters():
+    flushed = 0
+    error = None
+    for buffer in buffers:
+        try:
+            flushed += buffer.flush()
+        except Exception as e:
+            error = error or e
+    if error:
+        raise error
+    return flushed
+
+
+def counters_stats():
+    return [buffer.stats() for buffer in buffers]
+
+
+def start_flusher(app):
+    """Периодический сброс буферов счётчиков"""
+    return run_periodically(app, 'counter-flush', app.config['COUNTER_FLUSH_INTERVAL'], flush_counters)
+
+
+def init_counters(app):
+    for buffer in buffers:
+        buffer.flush_interval = app.config['COUNTER_FLUSH_INTERVAL']
+        buffer.max_pending = app.config['COUNTER_FLUSH_MAX_PENDING']
+    hot_posts.window = app.config['LIKES_HOT_WINDOW']
+    hot_posts.threshold = app.config['LIKES_HOT_THRESHOLD']
+    if app.config['COUNTER_FLUSH_INTERVAL'] > 0:
+        start_flusher(app)
+
+    # Сброс накопленного при штатной остановке воркера
+    def flush_on_exit():
+        try:
+            with app.app_context():
+                flush_counters()
+        except Exception as e:
+            app.logger.warning('Не удалось сбросить счётчики при остановке: %s', e)
+
+    atexit.register(flush_on_exit)
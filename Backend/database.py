@@ -0,0 +1,66 @@
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+from models import db
+from serving import cooperative
+
+# Подключение к базе.
+# Для SQLite каждое новое соединение получает PRAGMA из SQLITE_PRAGMAS: WAL (читатели не ждут
+# писателя), synchronous=NORMAL, busy_timeout вместо мгновенного "database is locked",
+# mmap и увеличенный кеш страниц. Размер пула задаётся в SQLALCHEMY_ENGINE_OPTIONS.
+# Под gevent пул и busy_timeout заменяются на GEVENT_* (см. config.py).
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def ignore_conflicts(table):
+    """INSERT, пропускающий строки с конфликтом уникального ключа; rowcount - число вставленных"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert()
+
+
+def init_database(app):
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if is_memory_sqlite(uri):
+        # Для базы в памяти Flask-SQLAlchemy использует StaticPool без параметров размера
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        for name in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+            options.pop(name, None)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    elif cooperative():
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            'pool_size': app.config['GEVENT_DB_POOL_SIZE'],
+            'max_overflow': 0,
+            'pool_timeout': app.config['GEVENT_DB_POOL_TIMEOUT'],
+        }
+        if app.config.get('SQLITE_PRAGMAS'):
+            app.config['SQLITE_PRAGMAS'] = {
+                **app.config['SQLITE_PRAGMAS'],
+                'busy_timeout': app.config['GEVENT_SQLITE_BUSY_TIMEOUT'],
+            }
+
+    db.init_app(app)
+
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if make_url(uri).get_backend_name() == 'sqlite' and pragmas:
+        with app.app_context():
+            event.listen(db.engine, 'connect',
+                         lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
@@ -0,0 +1,147 @@
+import heapq
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import defer
+
+from database import ignore_conflicts
+from models import db, User, Post, Follow, UserStats, TimelineEntry
+from pagination import decode_cursor, encode_cursor
+
+# Лента "посты тех, на кого я подписан".
+# Новый пост раскладывается по таблицам timeline_entries подписчиков (fan-out on write)
+# фоновой задачей пачками по FEED_FANOUT_BATCH. Для авторов, у которых подписчиков больше
+# FEED_FANOUT_LIMIT, раскладка не делается - их посты подмешиваются при чтении (fan-out on read).
+
+timeline_table = TimelineEntry.__table__
+
+
+def insert_ignore(rows):
+    if not rows:
+        return
+    db.session.execute(ignore_conflicts(timeline_table), rows)
+
+
+def is_celebrity(user_id):
+    followers = db.session.query(UserStats.followers_count).filter_by(user_id=user_id).scalar()
+    return (followers or 0) > current_app.config['FEED_FANOUT_LIMIT']
+
+
+# Фоновые задачи
+
+def fanout_post(post_id):
+    post = db.session.get(Post, post_id)
+    if not post or is_celebrity(post.user_id):
+        return
+
+    batch_size = current_app.config['FEED_FANOUT_BATCH']
+    last_id = 0
+    while True:
+        batch = db.session.query(Follow.id, Follow.follower_id)\
+            .filter(Follow.followed_id == post.user_id, Follow.id > last_id)\
+            .order_by(Follow.id)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            break
+
+        insert_ignore([{
+            'user_id': follower_id,
+            'post_id': post.id,
+            'author_id': post.user_id,
+            'created_at': post.created_at,
+        } for _, follower_id in batch])
+        db.session.commit()
+        last_id = batch[-1][0]
+
+
+def backfill_follow(follower_id, followed_id):
+    still_following = Follow.query.filter_by(follower_id=follower_id, followed_id=followed_id).first()
+    if not still_following or is_celebrity(followed_id):
+        return
+
+    posts = db.session.query(Post.id, Post.created_at)\
+        .filter(Post.user_id == followed_id)\
+        .order_by(Post.created_at.desc(), Post.id.desc())\
+        .limit(current_app.config['FEED_BACKFILL'])\
+        .all()
+
+    insert_ignore([{
+        'user_id': follower_id,
+        'post_id': post_id,
+        'author_id': followed_id,
+        'created_at': created_at,
+    } for post_id, created_at in posts])
+    db.session.commit()
+
+
+def prune_follow(follower_id, followed_id):
+    if Follow.query.filter_by(follower_id=follower_id, followed_id=followed_id).first():
+        return
+    TimelineEntry.query.filter_by(user_id=follower_id, author_id=followed_id)\
+        .delete(synchronize_session=False)
+    db.session.commit()
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    connection.execute(timeline_table.delete().where(timeline_table.c.post_id == post.id))
+
+
+@event.listens_for(User, 'before_delete')
+def _user_deleted(mapper, connection, user):
+    connection.execute(timeline_table.delete().where(timeline_table.c.user_id == user.id))
+
+
+# Чтение
+
+def _after(created_at_column, id_column, cursor):
+    created_at, item_id = cursor
+    return db.or_(
+        created_at_column < created_at,
+        db.and_(created_at_column == created_at, id_column < item_id)
+    )
+
+
+def get_feed(user_id, cursor, per_page):
+    """Посты ленты пользователя: (posts, next_cursor)"""
+    position = decode_cursor(cursor) if cursor else None
+
+    pushed = db.session.query(TimelineEntry.created_at, TimelineEntry.post_id)\
+        .filter(TimelineEntry.user_id == user_id)
+    if position:
+        pushed = pushed.filter(_after(TimelineEntry.created_at, TimelineEntry.post_id, position))
+    pushed = pushed.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())\
+        .limit(per_page + 1)\
+        .all()
+
+    # Свои посты и посты авторов без раскладки
+    limit = current_app.config['FEED_FANOUT_LIMIT']
+    pull_ids = [user_id] + [followed_id for (followed_id,) in db.session.query(Follow.followed_id)
+                            .join(UserStats, UserStats.user_id == Follow.followed_id)
+                            .filter(Follow.follower_id == user_id, UserStats.followers_count > limit)
+                            .all()]
+    pulled = db.session.query(Post.created_at, Post.id).filter(Post.user_id.in_(pull_ids))
+    if position:
+        pulled = pulled.filter(_after(Post.created_at, Post.id, position))
+    pulled = pulled.order_by(Post.created_at.desc(), Post.id.desc())\
+        .limit(per_page + 1)\
+        .all()
+
+    merged = []
+    seen = set()
+    for created_at, post_id in heapq.merge(pushed, pulled, reverse=True):
+        if post_id not in seen:
+            seen.add(post_id)
+            merged.append(post_id)
+        if len(merged) > per_page:
+            break
+
+    has_more = len(merged) > per_page
+    post_ids = merged[:per_page]
+    posts = Post.query.options(defer(Post.content)).filter(Post.id.in_(post_ids)).all() if post_ids else []
+    posts = {post.id: post for post in posts}
+    posts = [posts[post_id] for post_id in post_ids if post_id in posts]
+
+    next_cursor = encode_cursor(posts[-1]) if has_more and posts else None
+    return posts, next_cursor
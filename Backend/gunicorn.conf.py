@@ -0,0 +1,29 @@
+import os
+
+# Настройки gunicorn: gunicorn -c gunicorn.conf.py app:app
+# GUNICORN_WORKER_CLASS=sync - прежний режим (запрос занимает воркер целиком),
+# GUNICORN_WORKER_CLASS=gevent - до GUNICORN_WORKER_CONNECTIONS запросов на воркер в гринлетах.
+# Приложение загружается в мастере (preload_app), поэтому для gevent патч стандартной библиотеки
+# применяется здесь, до импорта app. Пул соединений под gevent настраивается в database.py.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+preload_app = True
+
+if worker_class == 'gevent':
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    # psycopg2 сам по себе блокирует цикл gevent на время запроса к PostgreSQL
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        pass
+    else:
+        patch_psycopg()
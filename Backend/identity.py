@@ -0,0 +1,62 @@
+from flask import current_app, jsonify
+
+from cache import MemoryBackend
+from models import db, User
+from serializers import user_profile
+
+# Кеш пользователя для JWT-эндпоинтов.
+# flask_jwt_extended вызывает user_lookup_loader один раз за запрос и хранит результат
+# в flask.g (current_user); здесь добавлен общий для воркера LRU с TTL, так что на тёплых
+# запросах пользователь не читается из базы вовсе.
+# В кеше лежит профиль без счётчиков (user_profile) - счётчики меняются чаще и берутся из user_stats.
+# Записи сбрасываются при изменении профиля, смене пароля и удалении аккаунта.
+
+
+class IdentityCache:
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, jwt):
+        self.backend = MemoryBackend(app.config['IDENTITY_CACHE_SIZE'])
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        jwt.user_lookup_loader(self._lookup)
+        jwt.user_lookup_error_loader(self._not_found)
+
+    def get(self, user_id):
+        """Профиль пользователя (dict) или None, если пользователя нет"""
+        identity = self.backend.get(user_id) if self.ttl else None
+        if identity is not None:
+            self.hits += 1
+            return identity
+
+        self.misses += 1
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        identity = user_profile.dump(user)
+        if self.ttl:
+            self.backend.set(user_id, identity, self.ttl, [f'user:{user_id}'])
+        return identity
+
+    def invalidate(self, user_id):
+        self.backend.invalidate([f'user:{user_id}'])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+        }
+
+    def _lookup(self, jwt_header, jwt_data):
+        return self.get(jwt_data[current_app.config['JWT_IDENTITY_CLAIM']])
+
+    def _not_found(self, jwt_header, jwt_data):
+        return jsonify({'success': False, 'error': 'Пользователь не найден'}), 404
+
+
+identities = IdentityCache()
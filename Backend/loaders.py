@@ -0,0 +1,88 @@
+from sqlalchemy import func
+
+from models import db, User, UserStats, Post, Playlist, PlaylistTrack, Review, Follow
+
+# Пакетная загрузка связанных данных для списков.
+# Вместо post.author.to_dict() на каждый элемент собираем id со всей страницы
+# и добираем их фиксированным числом запросов (счётчики берутся из user_stats).
+
+
+def grouped_counts(column, ids):
+    ids = list(set(ids))
+    if not ids:
+        return {}
+    rows = db.session.query(column, func.count())\
+        .filter(column.in_(ids))\
+        .group_by(column)\
+        .all()
+    return dict(rows)
+
+
+def count_user_stats(user_ids):
+    user_ids = list(set(user_ids))
+    posts = grouped_counts(Post.user_id, user_ids)
+    followers = grouped_counts(Follow.followed_id, user_ids)
+    following = grouped_counts(Follow.follower_id, user_ids)
+    playlists = grouped_counts(Playlist.user_id, user_ids)
+    reviews = grouped_counts(Review.user_id, user_ids)
+
+    reverse = db.aliased(Follow)
+    friends = dict(
+        db.session.query(Follow.follower_id, func.count())
+        .join(reverse, db.and_(reverse.follower_id == Follow.followed_id,
+                               reverse.followed_id == Follow.follower_id))
+        .filter(Follow.follower_id.in_(user_ids))
+        .group_by(Follow.follower_id)
+        .all()
+    ) if user_ids else {}
+
+    return {user_id: {
+        'posts_count': posts.get(user_id, 0),
+        'followers_count': followers.get(user_id, 0),
+        'following_count': following.get(user_id, 0),
+        'friends_count': friends.get(user_id, 0),
+        'playlists_count': playlists.get(user_id, 0),
+        'reviews_count': reviews.get(user_id, 0),
+    } for user_id in user_ids}
+
+
+def load_user_stats(user_ids):
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    rows = UserStats.query.filter(UserStats.user_id.in_(user_ids)).all()
+    stats = {row.user_id: row.to_dict() for row in rows}
+
+    # Пользователи без строки в user_stats (до запуска flask repair-stats)
+    missing = [user_id for user_id in user_ids if user_id not in stats]
+    if missing:
+        stats.update(count_user_stats(missing))
+    return stats
+
+
+def load_users(user_ids):
+    """Словарь id -> user.to_dict() для всех переданных id"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    users = User.query.filter(User.id.in_(user_ids)).all()
+    stats = load_user_stats(user_ids)
+    return {user.id: user.to_dict(stats=stats[user.id]) for user in users}
+
+
+def dump_users(users):
+    """Сериализация уже загруженных пользователей с пакетной статистикой"""
+    stats = load_user_stats([user.id for user in users])
+    return [user.to_dict(stats=stats[user.id]) for user in users]
+
+
+def load_post_authors(posts):
+    return load_users([post.user_id for post in posts])
+
+
+def load_playlist_creators(playlists):
+    return load_users([playlist.user_id for playlist in playlists])
+
+
+def load_tracks_counts(playlists):
+    return grouped_counts(PlaylistTrack.playlist_id, [playlist.id for playlist in playlists])
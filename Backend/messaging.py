@@ -0,0 +1,121 @@
+import heapq
+from datetime import datetime
+
+from sqlalchemy import event, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+import serializers
+from models import db, User, Message, Conversation
+from pagination import decode_cursor, encode_cursor
+
+# Личные сообщения.
+# Список диалогов читается из сводной таблицы conversations (по строке на участника: последнее
+# сообщение, число непрочитанных, время обновления), а не группировкой по всей таблице messages.
+# Сводка обновляется в той же транзакции, что и вставка сообщения (событие маппера Message),
+# одним upsert на участника. История диалога - keyset по (created_at, id): два запроса по индексу
+# ix_messages_pair_created_at (в одну и в другую сторону) сливаются, как в ленте.
+# Общее число непрочитанных считается по индексу ix_messages_receiver_is_read, не читая таблицу.
+
+conversations_table = Conversation.__table__
+
+
+def _upsert(connection, values, unread):
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect == 'sqlite' else postgresql).insert(conversations_table)
+        statement = insert.values(unread_count=unread, created_at=values['updated_at'], **values)\
+            .on_conflict_do_update(
+                index_elements=['user_id', 'peer_id'],
+                set_={
+                    'last_message_id': insert.excluded.last_message_id,
+                    'last_message_excerpt': insert.excluded.last_message_excerpt,
+                    'last_sender_id': insert.excluded.last_sender_id,
+                    'updated_at': insert.excluded.updated_at,
+                    'unread_count': conversations_table.c.unread_count + unread,
+                }
+            )
+        connection.execute(statement)
+        return
+
+    fields = {key: value for key, value in values.items() if key not in ('user_id', 'peer_id')}
+    updated = connection.execute(
+        conversations_table.update()
+        .where(conversations_table.c.user_id == values['user_id'],
+               conversations_table.c.peer_id == values['peer_id'])
+        .values(unread_count=conversations_table.c.unread_count + unread, **fields)
+    ).rowcount
+    if not updated:
+        connection.execute(conversations_table.insert().values(
+            unread_count=unread, created_at=values['updated_at'], **values))
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_sent(mapper, connection, message):
+    summary = {
+        'last_message_id': message.id,
+        'last_message_excerpt': serializers.make_excerpt(message.content),
+        'last_sender_id': message.sender_id,
+        'updated_at': message.created_at,
+    }
+    _upsert(connection, {'user_id': message.sender_id, 'peer_id': message.receiver_id, **summary}, 0)
+    _upsert(connection, {'user_id': message.receiver_id, 'peer_id': message.sender_id, **summary}, 1)
+
+
+@event.listens_for(User, 'before_delete')
+def _user_deleted(mapper, connection, user):
+    connection.execute(conversations_table.delete().where(db.or_(
+        conversations_table.c.user_id == user.id,
+        conversations_table.c.peer_id == user.id,
+    )))
+
+
+def send_message(sender_id, receiver_id, content):
+    message = Message(sender_id=sender_id, receiver_id=receiver_id, content=content,
+                      is_read=False, created_at=datetime.now())
+    db.session.add(message)
+    db.session.commit()
+    return message
+
+
+def mark_conversation_read(user_id, peer_id):
+    """Все входящие от peer_id прочитаны; возвращает число отмеченных сообщений"""
+    updated = Message.query\
+        .filter(Message.sender_id == peer_id, Message.receiver_id == user_id, Message.is_read.is_(False))\
+        .update({Message.is_read: True}, synchronize_session=False)
+    Conversation.query.filter_by(user_id=user_id, peer_id=peer_id)\
+        .update({Conversation.unread_count: 0}, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
+def unread_total(user_id):
+    return db.session.query(func.count(Message.id))\
+        .filter(Message.receiver_id == user_id, Message.is_read.is_(False))\
+        .scalar()
+
+
+def _after(position):
+    created_at, message_id = position
+    return db.or_(
+        Message.created_at < created_at,
+        db.and_(Message.created_at == created_at, Message.id < message_id)
+    )
+
+
+def get_history(user_id, peer_id, cursor, per_page):
+    """Сообщения диалога от новых к старым: (messages, next_cursor)"""
+    position = decode_cursor(cursor) if cursor else None
+
+    def direction(sender_id, receiver_id):
+        query = Message.query.filter(Message.sender_id == sender_id, Message.receiver_id == receiver_id)
+        if position:
+            query = query.filter(_after(position))
+        return query.order_by(Message.created_at.desc(), Message.id.desc()).limit(per_page + 1).all()
+
+    merged = list(heapq.merge(direction(user_id, peer_id), direction(peer_id, user_id),
+                              key=lambda message: (message.created_at, message.id), reverse=True))
+    next_cursor = None
+    if len(merged) > per_page:
+        merged = merged[:per_page]
+        next_cursor = encode_cursor(merged[-1])
+    return merged, next_cursor
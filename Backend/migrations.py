@@ -0,0 +1,161 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db, Conversation
+from serializers import EXCERPT_LENGTH
+from search import create_search_indexes
+
+# Версионированные миграции схемы.
+# db.create_all() создаёт только отсутствующие таблицы, поэтому изменения существующих
+# таблиц (индексы, новые колонки) применяются здесь: `flask migrate` или `flask bootstrap`.
+# Каждая миграция идемпотентна - на свежей базе после create_all она просто помечается применённой.
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return decorator
+
+
+def create_index(connection, name, table, *columns):
+    connection.execute(text(
+        f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'
+    ))
+
+
+def add_column(connection, table, column, ddl):
+    columns = [c['name'] for c in inspect(connection).get_columns(table)]
+    if column not in columns:
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+@migration(1, 'hot path indexes')
+def _hot_path_indexes(connection):
+    create_index(connection, 'ix_posts_created_at', 'posts', 'created_at')
+    create_index(connection, 'ix_posts_type_created_at', 'posts', 'post_type', 'created_at')
+    create_index(connection, 'ix_posts_user_created_at', 'posts', 'user_id', 'created_at')
+    create_index(connection, 'ix_comments_post_created_at', 'comments', 'post_id', 'created_at')
+    create_index(connection, 'ix_follows_followed_id', 'follows', 'followed_id')
+    create_index(connection, 'ix_playlists_public_created_at', 'playlists', 'is_public', 'created_at')
+    create_index(connection, 'ix_concerts_date_city_country', 'concerts', 'date', 'city', 'country')
+
+
+@migration(2, 'full text search')
+def _full_text_search(connection):
+    create_search_indexes(connection)
+
+
+@migration(3, 'popular posts index')
+def _popular_posts_index(connection):
+    create_index(connection, 'ix_posts_likes_count', 'posts', 'likes_count')
+
+
+@migration(4, 'comment replies index')
+def _comment_replies_index(connection):
+    create_index(connection, 'ix_comments_parent_created_at', 'comments', 'parent_comment_id', 'created_at')
+
+
+@migration(5, 'stored excerpts')
+def _stored_excerpts(connection):
+    for table, source in (('posts', 'content'), ('playlists', 'description'), ('courses', 'description')):
+        add_column(connection, table, 'excerpt', f'VARCHAR({EXCERPT_LENGTH + 3})')
+        connection.execute(text(
+            f"UPDATE {table} SET excerpt = CASE WHEN length({source}) > {EXCERPT_LENGTH} "
+            f"THEN substr({source}, 1, {EXCERPT_LENGTH}) || '...' ELSE {source} END "
+            f"WHERE excerpt IS NULL AND {source} IS NOT NULL"
+        ))
+
+
+@migration(6, 'notification actors and indexes')
+def _notification_actors(connection):
+    add_column(connection, 'notifications', 'actor_id', 'INTEGER')
+    create_index(connection, 'ix_notifications_user_created_at', 'notifications', 'user_id', 'created_at')
+    create_index(connection, 'ix_notifications_user_is_read', 'notifications', 'user_id', 'is_read')
+    create_index(connection, 'ix_notifications_dedupe', 'notifications', 'user_id', 'type', 'reference_id', 'actor_id')
+
+
+@migration(7, 'conversation summaries')
+def _conversation_summaries(connection):
+    create_index(connection, 'ix_messages_receiver_is_read', 'messages', 'receiver_id', 'is_read')
+    create_index(connection, 'ix_messages_pair_created_at', 'messages', 'sender_id', 'receiver_id', 'created_at')
+    Conversation.__table__.create(connection, checkfirst=True)
+    # Сводки по уже отправленным сообщениям: по строке на каждого участника пары
+    connection.execute(text(
+        'INSERT INTO conversations (user_id, peer_id, unread_count, created_at, updated_at, last_message_id) '
+        'SELECT user_id, peer_id, sum(unread), min(created_at), max(created_at), max(id) FROM ('
+        '  SELECT sender_id AS user_id, receiver_id AS peer_id, 0 AS unread, created_at, id FROM messages'
+        '  UNION ALL'
+        '  SELECT receiver_id, sender_id, CASE WHEN is_read THEN 0 ELSE 1 END, created_at, id FROM messages'
+        ') AS pairs '
+        'WHERE NOT EXISTS (SELECT 1 FROM conversations c WHERE c.user_id = pairs.user_id AND c.peer_id = pairs.peer_id) '
+        'GROUP BY user_id, peer_id'
+    ))
+    connection.execute(text(
+        f"UPDATE conversations SET "
+        f"last_sender_id = (SELECT sender_id FROM messages WHERE messages.id = conversations.last_message_id), "
+        f"last_message_excerpt = (SELECT CASE WHEN length(content) > {EXCERPT_LENGTH} "
+        f"THEN substr(content, 1, {EXCERPT_LENGTH}) || '...' ELSE content END "
+        f"FROM messages WHERE messages.id = conversations.last_message_id) "
+        f"WHERE last_sender_id IS NULL AND last_message_id IS NOT NULL"
+    ))
+
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def applied_versions():
+    with db.engine.begin() as connection:
+        _ensure_version_table(connection)
+        return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def run_migrations():
+    """Применяет недостающие миграции по порядку, каждую в своей транзакции"""
+    done = applied_versions()
+    applied = []
+
+    for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done:
+            continue
+        with db.engine.begin() as connection:
+            fn(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t) '
+                     'ON CONFLICT (version) DO NOTHING'),
+                {'v': version, 'n': name, 't': datetime.now()}
+            )
+        applied.append((version, name))
+
+    return applied
+
+
+def explain(query):
+    """План выполнения запроса SQLAlchemy (SQLite или PostgreSQL)"""
+    compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with db.engine.connect() as connection:
+        rows = connection.execute(text(prefix + str(compiled))).fetchall()
+    if db.engine.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+@migration(8, 'token versions')
+def _token_versions(connection):
+    add_column(connection, 'users', 'token_version', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'revoked_tokens', 'token_version', 'INTEGER')
+    # Старые отсечки по времени становятся версией 1: токены без claim ver у этих пользователей
+    # перестают действовать, как и раньше
+    connection.execute(text(
+        'UPDATE users SET token_version = 1 WHERE token_version = 0 '
+        'AND id IN (SELECT user_id FROM revoked_tokens WHERE jti IS NULL)'
+    ))
+    connection.execute(text('UPDATE revoked_tokens SET token_version = 1 WHERE jti IS NULL AND token_version IS NULL'))
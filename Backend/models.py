@@ -1,10 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-import json
+import serializers
+from passwords import hasher
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 post_tags = db.Table('post_tags',
     db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True),
@@ -28,6 +29,8 @@ class User(db.Model, UserMixin):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     last_login = db.Column(db.DateTime, nullable=True)
+    # Увеличивается при отзыве всех токенов (смена пароля, удаление); токены несут её в claim ver
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
 
     posts = db.relationship('Post', backref='author', lazy=True, cascade='all, delete-orphan')
@@ -52,19 +55,26 @@ class User(db.Model, UserMixin):
     course_enrollments = db.relationship('CourseEnrollment', backref='user', lazy=True, cascade='all, delete-orphan')
     
 
-    sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy=True)
-    received_messages = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver', lazy=True)
+    sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy=True,
+                                    cascade='all, delete-orphan')
+    received_messages = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver', lazy=True,
+                                        cascade='all, delete-orphan')
     
 
     notifications = db.relationship('Notification', backref='user', lazy=True, cascade='all, delete-orphan')
     
     saved_posts = db.relationship('SavedPost', backref='user', lazy=True, cascade='all, delete-orphan')
     
+    stats = db.relationship('UserStats', uselist=False, lazy=True, viewonly=True)
+    
     def set_password(self, password):
-        self.hashed_password = generate_password_hash(password)
+        self.hashed_password = hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.hashed_password, password)
+        return hasher.verify(self.hashed_password, password)
+    
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.hashed_password)
     
     def change_password(self, current_password, new_password):
         if not self.check_password(current_password):
@@ -72,35 +82,28 @@ class User(db.Model, UserMixin):
         self.set_password(new_password)
         return True
     
-    def to_dict(self):
-        genres_list = []
-        if self.genres:
-            try:
-                genres_list = json.loads(self.genres)
-            except:
-                genres_list = []
-        
+    def compute_stats(self):
+        reverse = db.aliased(Follow)
         return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'bio': self.bio,
-            'avatar_url': self.avatar_url,
-            'location': self.location,
-            'website': self.website,
-            'genres': genres_list,
-            'is_verified': self.is_verified,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_login': self.last_login.isoformat() if self.last_login else None,
-            'stats': {
-                'posts_count': len(self.posts),
-                'followers_count': self.followers.count(),
-                'following_count': self.following.count(),
-                'playlists_count': len(self.playlists),
-                'reviews_count': len(self.reviews),
-            }
+            'posts_count': len(self.posts),
+            'followers_count': self.followers.count(),
+            'following_count': self.following.count(),
+            'playlists_count': len(self.playlists),
+            'reviews_count': len(self.reviews),
+            'friends_count': self.following.join(
+                reverse, db.and_(reverse.follower_id == Follow.followed_id,
+                                 reverse.followed_id == Follow.follower_id)
+            ).count(),
         }
     
+    def get_stats(self):
+        if self.stats:
+            return self.stats.to_dict()
+        return self.compute_stats()
+    
+    def to_dict(self, stats=None):
+        return serializers.user_full.dump(self, stats=stats)
+    
     def is_following(self, user):
         return self.following.filter_by(followed_id=user.id).first() is not None
     
@@ -121,12 +124,27 @@ class User(db.Model, UserMixin):
             return True
         return False
 
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    posts_count = db.Column(db.Integer, nullable=False, default=0)
+    followers_count = db.Column(db.Integer, nullable=False, default=0)
+    following_count = db.Column(db.Integer, nullable=False, default=0)
+    friends_count = db.Column(db.Integer, nullable=False, default=0)
+    playlists_count = db.Column(db.Integer, nullable=False, default=0)
+    reviews_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return serializers.user_stats_schema.dump(self)
+
 class Post(db.Model):
     __tablename__ = 'posts'
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    excerpt = db.Column(db.String(serializers.EXCERPT_LENGTH + 3), nullable=True)
     post_type = db.Column(db.String(50), nullable=False) 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     track_id = db.Column(db.String(100), nullable=True) 
@@ -145,26 +163,22 @@ class Post(db.Model):
     tags = db.relationship('Tag', secondary=post_tags, backref=db.backref('posts', lazy=True))
     saved_by = db.relationship('SavedPost', backref='post', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_posts_created_at', 'created_at'),
+        db.Index('ix_posts_type_created_at', 'post_type', 'created_at'),
+        db.Index('ix_posts_user_created_at', 'user_id', 'created_at'),
+        db.Index('ix_posts_likes_count', 'likes_count'),
+    )
+    
+    @db.validates('content')
+    def _set_excerpt(self, key, value):
+        self.excerpt = serializers.make_excerpt(value)
+        return value
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'content': self.content,
-            'post_type': self.post_type,
-            'author': self.author.to_dict(),
-            'track_id': self.track_id,
-            'track_name': self.track_name,
-            'artist_name': self.artist_name,
-            'album_art_url': self.album_art_url,
-            'media_url': self.media_url,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'likes_count': self.likes_count,
-            'comments_count': self.comments_count,
-            'views_count': self.views_count,
-            'tags': [tag.name for tag in self.tags],
-            'comments': [comment.to_dict() for comment in self.comments[:10]],
-        }
+        data = serializers.post_full.dump(self)
+        data['comments'] = serializers.comment_schema.dump_many(self.comments[:10])
+        return data
 
 class PostLike(db.Model):
     __tablename__ = 'post_likes'
@@ -191,17 +205,13 @@ class Comment(db.Model):
     
     replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_comments_post_created_at', 'post_id', 'created_at'),
+        db.Index('ix_comments_parent_created_at', 'parent_comment_id', 'created_at'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'content': self.content,
-            'author': self.author.to_dict(),
-            'post_id': self.post_id,
-            'parent_comment_id': self.parent_comment_id,
-            'likes_count': self.likes_count,
-            'created_at': self.created_at.isoformat(),
-            'replies_count': len(self.replies),
-        }
+        return serializers.comment_schema.dump(self)
 
 class Playlist(db.Model):
     __tablename__ = 'playlists'
@@ -209,6 +219,7 @@ class Playlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
+    excerpt = db.Column(db.String(serializers.EXCERPT_LENGTH + 3), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     is_public = db.Column(db.Boolean, default=True)
     cover_url = db.Column(db.String(500), nullable=True)
@@ -218,20 +229,17 @@ class Playlist(db.Model):
     
     tracks = db.relationship('PlaylistTrack', backref='playlist', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_playlists_public_created_at', 'is_public', 'created_at'),
+    )
+    
+    @db.validates('description')
+    def _set_excerpt(self, key, value):
+        self.excerpt = serializers.make_excerpt(value)
+        return value
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'creator': self.creator.to_dict(),
-            'is_public': self.is_public,
-            'cover_url': self.cover_url,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'plays_count': self.plays_count,
-            'tracks_count': len(self.tracks),
-            'tracks': [track.to_dict() for track in self.tracks[:20]],
-        }
+        return serializers.playlist_full.dump(self)
 
 class PlaylistTrack(db.Model):
     __tablename__ = 'playlist_tracks'
@@ -249,18 +257,9 @@ class PlaylistTrack(db.Model):
     
     added_by_user = db.relationship('User', foreign_keys=[added_by])
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'track_id': self.track_id,
-            'track_name': self.track_name,
-            'artist_name': self.artist_name,
-            'album_name': self.album_name,
-            'album_art_url': self.album_art_url,
-            'duration_ms': self.duration_ms,
-            'added_at': self.added_at.isoformat(),
-            'added_by': self.added_by_user.to_dict() if self.added_by_user else None,
-        }
+    def to_dict(self, added_by=None):
+        users = {self.added_by: added_by} if added_by is not None else None
+        return serializers.track_schema.dump(self, users=users)
 
 class Review(db.Model):
     __tablename__ = 'reviews'
@@ -278,18 +277,7 @@ class Review(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'rating': self.rating,
-            'content': self.content,
-            'author': self.author.to_dict(),
-            'track_id': self.track_id,
-            'track_name': self.track_name,
-            'artist_name': self.artist_name,
-            'album_art_url': self.album_art_url,
-            'likes_count': self.likes_count,
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.review_schema.dump(self)
 
 class Concert(db.Model):
     __tablename__ = 'concerts'
@@ -306,20 +294,12 @@ class Concert(db.Model):
     price_range = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    __table_args__ = (
+        db.Index('ix_concerts_date_city_country', 'date', 'city', 'country'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'artist_name': self.artist_name,
-            'venue': self.venue,
-            'city': self.city,
-            'country': self.country,
-            'date': self.date.isoformat(),
-            'ticket_url': self.ticket_url,
-            'image_url': self.image_url,
-            'description': self.description,
-            'price_range': self.price_range,
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.concert_full.dump(self)
 
 class Tag(db.Model):
     __tablename__ = 'tags'
@@ -331,12 +311,7 @@ class Tag(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'tag_type': self.tag_type,
-            'popularity': self.popularity,
-        }
+        return serializers.tag_schema.dump(self)
 
 class Follow(db.Model):
     __tablename__ = 'follows'
@@ -348,15 +323,41 @@ class Follow(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('follower_id', 'followed_id', name='unique_follow'),
+        db.Index('ix_follows_followed_id', 'followed_id'),
     )
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'follower': self.follower.to_dict(),
-            'followed': self.followed.to_dict(),
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.follow_schema.dump(self)
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    
+    # jti = NULL означает "все токены user_id с версией меньше token_version"
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=True, unique=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    token_version = db.Column(db.Integer, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    
+    __table_args__ = (
+        db.Index('ix_revoked_tokens_expires_at', 'expires_at'),
+    )
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='unique_timeline_post'),
+        db.Index('ix_timeline_user_created_at', 'user_id', 'created_at', 'post_id'),
+        db.Index('ix_timeline_user_author', 'user_id', 'author_id'),
+    )
 
 class Course(db.Model):
     __tablename__ = 'courses'
@@ -364,6 +365,7 @@ class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
+    excerpt = db.Column(db.String(serializers.EXCERPT_LENGTH + 3), nullable=True)
     instructor = db.Column(db.String(100), nullable=False)
     instrument = db.Column(db.String(50), nullable=False) 
     level = db.Column(db.String(20), nullable=False) 
@@ -375,22 +377,13 @@ class Course(db.Model):
     rating = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    @db.validates('description')
+    def _set_excerpt(self, key, value):
+        self.excerpt = serializers.make_excerpt(value)
+        return value
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'instructor': self.instructor,
-            'instrument': self.instrument,
-            'level': self.level,
-            'price': self.price,
-            'duration': self.duration,
-            'video_url': self.video_url,
-            'thumbnail_url': self.thumbnail_url,
-            'students_count': self.students_count,
-            'rating': self.rating,
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.course_full.dump(self)
 
 class CourseEnrollment(db.Model):
     __tablename__ = 'course_enrollments'
@@ -410,15 +403,7 @@ class CourseEnrollment(db.Model):
     course = db.relationship('Course', backref='enrollments')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'user': self.user.to_dict(),
-            'course': self.course.to_dict(),
-            'enrolled_at': self.enrolled_at.isoformat(),
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'progress': self.progress,
-            'rating': self.rating,
-        }
+        return serializers.enrollment_schema.dump(self)
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
@@ -430,20 +415,18 @@ class Notification(db.Model):
     message = db.Column(db.Text, nullable=False)
     reference_id = db.Column(db.Integer, nullable=True)  
     reference_type = db.Column(db.String(50), nullable=True) 
+    actor_id = db.Column(db.Integer, nullable=True)  # кто вызвал уведомление
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    __table_args__ = (
+        db.Index('ix_notifications_user_created_at', 'user_id', 'created_at'),
+        db.Index('ix_notifications_user_is_read', 'user_id', 'is_read'),
+        db.Index('ix_notifications_dedupe', 'user_id', 'type', 'reference_id', 'actor_id'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'type': self.type,
-            'title': self.title,
-            'message': self.message,
-            'reference_id': self.reference_id,
-            'reference_type': self.reference_type,
-            'is_read': self.is_read,
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.notification_schema.dump(self)
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -455,15 +438,37 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    __table_args__ = (
+        db.Index('ix_messages_receiver_is_read', 'receiver_id', 'is_read'),
+        db.Index('ix_messages_pair_created_at', 'sender_id', 'receiver_id', 'created_at'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'sender': self.sender.to_dict(),
-            'receiver': self.receiver.to_dict(),
-            'content': self.content,
-            'is_read': self.is_read,
-            'created_at': self.created_at.isoformat(),
-        }
+        return serializers.message_schema.dump(self)
+
+class Conversation(db.Model):
+    """Сводка диалога для одного участника; обновляется при отправке сообщения (messaging.py)"""
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_excerpt = db.Column(db.String(serializers.EXCERPT_LENGTH + 3), nullable=True)
+    last_sender_id = db.Column(db.Integer, nullable=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    
+    peer = db.relationship('User', foreign_keys=[peer_id], viewonly=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'peer_id', name='unique_conversation_peer'),
+        db.Index('ix_conversations_user_updated_at', 'user_id', 'updated_at'),
+    )
+    
+    def to_dict(self):
+        return serializers.conversation_schema.dump(self)
 
 class SavedPost(db.Model):
     __tablename__ = 'saved_posts'
@@ -479,66 +484,72 @@ class SavedPost(db.Model):
     )
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'post': self.post.to_dict(),
-            'saved_at': self.saved_at.isoformat(),
-            'folder': self.folder,
-        }
+        return serializers.saved_post_schema.dump(self)
 
 
-def init_db(app):
-    db.init_app(app)
-    with app.app_context():
-        db.create_all()
+def seed_database():
+    """Начальные данные: теги, admin и (для пустой базы) testuser; существующее не трогается"""
+    created = []
+    empty = User.query.count() == 0
+    if Tag.query.count() == 0:
+        default_tags = [
+            ('Rock', 'genre'),
+            ('Pop', 'genre'),
+            ('Hip-Hop', 'genre'),
+            ('Jazz', 'genre'),
+            ('Classical', 'genre'),
+            ('Electronic', 'genre'),
+            ('Indie', 'genre'),
+            ('Metal', 'genre'),
+            ('Folk', 'genre'),
+            ('R&B', 'genre'),
+            ('Soul', 'genre'),
+            ('Reggae', 'genre'),
+            ('Country', 'genre'),
+            ('Blues', 'genre'),
+            ('Funk', 'genre'),
+            ('Happy', 'mood'),
+            ('Sad', 'mood'),
+            ('Energetic', 'mood'),
+            ('Relaxing', 'mood'),
+            ('Romantic', 'mood'),
+            ('Guitar', 'instrument'),
+            ('Piano', 'instrument'),
+            ('Drums', 'instrument'),
+            ('Bass', 'instrument'),
+            ('Violin', 'instrument'),
+            ('Saxophone', 'instrument'),
+            ('80s', 'era'),
+            ('90s', 'era'),
+            ('2000s', 'era'),
+            ('2020s', 'era'),
+        ]
         
-        if Tag.query.count() == 0:
-            default_tags = [
-                ('Rock', 'genre'),
-                ('Pop', 'genre'),
-                ('Hip-Hop', 'genre'),
-                ('Jazz', 'genre'),
-                ('Classical', 'genre'),
-                ('Electronic', 'genre'),
-                ('Indie', 'genre'),
-                ('Metal', 'genre'),
-                ('Folk', 'genre'),
-                ('R&B', 'genre'),
-                ('Soul', 'genre'),
-                ('Reggae', 'genre'),
-                ('Country', 'genre'),
-                ('Blues', 'genre'),
-                ('Funk', 'genre'),
-                ('Happy', 'mood'),
-                ('Sad', 'mood'),
-                ('Energetic', 'mood'),
-                ('Relaxing', 'mood'),
-                ('Romantic', 'mood'),
-                ('Guitar', 'instrument'),
-                ('Piano', 'instrument'),
-                ('Drums', 'instrument'),
-                ('Bass', 'instrument'),
-                ('Violin', 'instrument'),
-                ('Saxophone', 'instrument'),
-                ('80s', 'era'),
-                ('90s', 'era'),
-                ('2000s', 'era'),
-                ('2020s', 'era'),
-            ]
-            
-            for name, tag_type in default_tags:
-                tag = Tag(name=name, tag_type=tag_type)
-                db.session.add(tag)
+        for name, tag_type in default_tags:
+            tag = Tag(name=name, tag_type=tag_type)
+            db.session.add(tag)
+        created.append('теги')
 
-        if User.query.filter_by(username='admin').count() == 0:
-            admin = User(
-                username='admin',
-                email='admin@musblossom.com',
-                bio='Основатель MusBlossom',
-                is_verified=True
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-        
-        db.session.commit()
\ No newline at end of file
+    if User.query.filter_by(username='admin').count() == 0:
+        admin = User(
+            username='admin',
+            email='admin@musblossom.com',
+            bio='Основатель MusBlossom',
+            is_verified=True
+        )
+        admin.set_password('admin123')
+        db.session.add(admin)
+        created.append('admin')
+
+    if empty:
+        test_user = User(
+            username='testuser',
+            email='test@musblossom.com',
+            bio='Тестовый пользователь'
+        )
+        test_user.set_password('test123')
+        db.session.add(test_user)
+        created.append('testuser')
+
+    db.session.commit()
+    return created
\ No newline at end of file
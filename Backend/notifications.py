@@ -0,0 +1,312 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import Response, current_app
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import Session, object_session
+
+import serializers
+from cache import MemoryBackend
+from models import db, Notification, Comment, Follow, Post, User
+from serving import cooperative
+from tasks import run_periodically
+
+# Уведомления о лайках, комментариях и подписках.
+# Строка notifications пишется в той же транзакции, что и лайк/комментарий/подписка (события
+# маппера, для лайка - явный вызов post_liked), поэтому таблица - надёжный источник: поток SSE после переподключения дочитывает
+# пропущенное по Last-Event-ID (id уведомления).
+# После коммита хаб воркера будит потоки получателя; уведомления, созданные в других воркерах,
+# замечает опрос таблицы раз в NOTIFICATIONS_POLL_SECONDS - один запрос на воркер, а не на поток.
+# Поток без событий ничего не читает из базы и не держит соединение, только шлёт комментарий-пинг.
+# Тысячи открытых потоков на воркер рассчитаны на режим gevent. Sync-воркер открытый поток
+# занимает целиком, поэтому там ответ работает как long-poll: отдаёт накопившиеся события и сразу
+# закрывается, а EventSource переподключается через NOTIFICATIONS_SYNC_RETRY_MS с Last-Event-ID.
+
+notifications_table = Notification.__table__
+posts_table = Post.__table__
+users_table = User.__table__
+comments_table = Comment.__table__
+
+
+# Создание уведомлений
+
+def _pending(session):
+    return session.info.setdefault('notify_users', set())
+
+
+def _username(connection, user_id):
+    return connection.execute(select(users_table.c.username).where(users_table.c.id == user_id)).scalar()
+
+
+def _already_notified(connection, user_id, kind, reference_id, actor_id):
+    return connection.execute(select(notifications_table.c.id).where(and_(
+        notifications_table.c.user_id == user_id,
+        notifications_table.c.type == kind,
+        notifications_table.c.reference_id == reference_id,
+        notifications_table.c.actor_id == actor_id,
+    )).limit(1)).first() is not None
+
+
+def notify(connection, session, user_id, kind, title, message, reference_type, reference_id, actor_id):
+    """Запись уведомления в транзакции session; получатель будится после коммита"""
+    connection.execute(notifications_table.insert().values(
+        user_id=user_id, type=kind, title=title, message=message, reference_type=reference_type,
+        reference_id=reference_id, actor_id=actor_id, is_read=False, created_at=datetime.now()
+    ))
+    _pending(session).add(user_id)
+
+
+def post_liked(session, post_id, user_id):
+    """Уведомление автору о новом лайке.
+
+    Лайк вставляется не через ORM (INSERT ... ON CONFLICT DO NOTHING в api_toggle_like),
+    поэтому событие маппера не срабатывает и уведомление создаётся явно, в той же транзакции.
+    """
+    connection = session.connection(bind_arguments={'bind': db.engine})
+    post = connection.execute(
+        select(posts_table.c.user_id, posts_table.c.title).where(posts_table.c.id == post_id)
+    ).first()
+    if post is None or post.user_id == user_id:
+        return
+    # Повторный лайк после снятия не присылает уведомление ещё раз
+    if _already_notified(connection, post.user_id, 'like', post_id, user_id):
+        return
+    actor = _username(connection, user_id)
+    notify(connection, session, post.user_id, 'like', 'Новый лайк',
+           f'{actor} оценил(а) ваш пост «{post.title}»', 'post', post_id, user_id)
+
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, comment):
+    post = connection.execute(
+        select(posts_table.c.user_id, posts_table.c.title).where(posts_table.c.id == comment.post_id)
+    ).first()
+    parent_author = None
+    if comment.parent_comment_id is not None:
+        parent_author = connection.execute(
+            select(comments_table.c.user_id).where(comments_table.c.id == comment.parent_comment_id)
+        ).scalar()
+
+    recipients = []
+    if post is not None and post.user_id != comment.user_id:
+        recipients.append((post.user_id, 'comment', 'Новый комментарий', 'прокомментировал(а) ваш пост «{}»'))
+    if parent_author is not None and parent_author not in (comment.user_id, post and post.user_id):
+        recipients.append((parent_author, 'reply', 'Ответ на комментарий', 'ответил(а) на ваш комментарий к посту «{}»'))
+    if not recipients:
+        return
+
+    actor = _username(connection, comment.user_id)
+    for user_id, kind, title, message in recipients:
+        notify(connection, object_session(comment), user_id, kind, title, f'{actor} ' + message.format(post.title if post else ''),
+               'post', comment.post_id, comment.user_id)
+
+
+@event.listens_for(Follow, 'after_insert')
+def _user_followed(mapper, connection, follow):
+    if _already_notified(connection, follow.followed_id, 'follow', follow.follower_id, follow.follower_id):
+        return
+    actor = _username(connection, follow.follower_id)
+    notify(connection, object_session(follow), follow.followed_id, 'follow', 'Новый подписчик',
+           f'{actor} подписался(ась) на вас', 'user', follow.follower_id, follow.follower_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_recipients(session):
+    user_ids = session.info.pop('notify_users', None)
+    if user_ids:
+        unread_counts.invalidate(user_ids)
+        hub.publish(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_recipients(session):
+    session.info.pop('notify_users', None)
+
+
+# Непрочитанные
+
+class UnreadCounts:
+    """Число непрочитанных уведомлений с кешем в памяти воркера"""
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.ttl = 30
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(app.config['NOTIFICATIONS_UNREAD_CACHE_SIZE'])
+        self.ttl = app.config['NOTIFICATIONS_UNREAD_TTL']
+
+    def get(self, user_id):
+        count = self.backend.get(user_id) if self.ttl else None
+        if count is None:
+            count = db.session.query(func.count(Notification.id))\
+                .filter(Notification.user_id == user_id, Notification.is_read.is_(False))\
+                .scalar()
+            if self.ttl:
+                self.backend.set(user_id, count, self.ttl, [f'unread:{user_id}'])
+        return count
+
+    def invalidate(self, user_ids):
+        self.backend.invalidate([f'unread:{user_id}' for user_id in user_ids])
+
+
+def mark_read(user_id, ids=None, up_to=None):
+    """Отметка прочитанными: перечисленных id, всех до up_to включительно или всех сразу"""
+    query = Notification.query.filter(Notification.user_id == user_id, Notification.is_read.is_(False))
+    if ids is not None:
+        query = query.filter(Notification.id.in_(ids))
+    if up_to is not None:
+        query = query.filter(Notification.id <= up_to)
+    updated = query.update({Notification.is_read: True}, synchronize_session=False)
+    db.session.commit()
+    if updated:
+        unread_counts.invalidate([user_id])
+        hub.publish([user_id])
+    return updated
+
+
+# Поток событий
+
+class Subscription:
+    __slots__ = ('user_id', 'event')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+
+
+class NotificationHub:
+    def __init__(self):
+        self.poll_interval = 2
+        self.heartbeat = 15
+        self.stream_seconds = 300
+        self.sync_retry_ms = 10000
+        self.retry_ms = 3000
+        self.batch = 100
+        self._lock = threading.Lock()
+        self._subscribers = {}   # user_id -> set(Subscription)
+        self._last_id = None
+        self.published = 0
+
+    def init_app(self, app):
+        self.poll_interval = app.config['NOTIFICATIONS_POLL_SECONDS']
+        self.heartbeat = app.config['NOTIFICATIONS_HEARTBEAT_SECONDS']
+        self.stream_seconds = app.config['NOTIFICATIONS_STREAM_SECONDS']
+        self.sync_retry_ms = app.config['NOTIFICATIONS_SYNC_RETRY_MS']
+        self.retry_ms = app.config['NOTIFICATIONS_RETRY_MS']
+        self.batch = app.config['NOTIFICATIONS_BATCH']
+        if self.poll_interval > 0:
+            run_periodically(app, 'notifications-poll', self.poll_interval, self.poll)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_ids):
+        with self._lock:
+            woken = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+        for subscription in woken:
+            subscription.event.set()
+        self.published += len(woken)
+
+    def poll(self):
+        """Уведомления, созданные другими воркерами: одна выборка по новым id"""
+        if self._last_id is None or not self._subscribers:
+            self._last_id = db.session.query(func.max(Notification.id)).scalar() or 0
+            return
+        rows = db.session.query(Notification.user_id, func.max(Notification.id))\
+            .filter(Notification.id > self._last_id)\
+            .group_by(Notification.user_id)\
+            .all()
+        if rows:
+            self._last_id = max(last_id for _, last_id in rows)
+            self.publish([user_id for user_id, _ in rows])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._subscribers),
+                'streams': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'published': self.published,
+            }
+
+    def stream(self, user_id, last_event_id=None):
+        """Ответ text/event-stream для пользователя"""
+        app = current_app._get_current_object()
+        events = self._events(app, user_id, last_event_id) if cooperative() \
+            else self._long_poll(app, user_id, last_event_id)
+        return Response(events, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    def _batch(self, app, user_id, last_id):
+        """Уведомления после last_id и число непрочитанных: (текст событий, новый last_id, число строк)"""
+        # Свой app context без запроса: чтение идёт с основной базы, соединение
+        # возвращается в пул до следующего события
+        with app.app_context():
+            try:
+                if last_id is None:
+                    last_id = db.session.query(func.max(Notification.id))\
+                        .filter(Notification.user_id == user_id).scalar() or 0
+                    rows = []
+                else:
+                    rows = Notification.query\
+                        .filter(Notification.user_id == user_id, Notification.id > last_id)\
+                        .order_by(Notification.id)\
+                        .limit(self.batch)\
+                        .all()
+                events = [_event(row.id, 'notification', serializers.notification_schema.dump(row))
+                          for row in rows]
+                if rows:
+                    last_id = rows[-1].id
+                # id у события непрочитанных - чтобы переподключение пришло с Last-Event-ID
+                events.append(_event(last_id, 'unread', {'count': unread_counts.get(user_id)}))
+            finally:
+                db.session.remove()
+        return ''.join(events), last_id, len(rows)
+
+    def _long_poll(self, app, user_id, last_id):
+        events, _, _ = self._batch(app, user_id, last_id)
+        yield f'retry: {self.sync_retry_ms}\n\n' + events
+
+    def _events(self, app, user_id, last_id):
+        subscription = self.subscribe(user_id)
+        deadline = time.time() + self.stream_seconds
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            while True:
+                subscription.event.clear()
+                events, last_id, count = self._batch(app, user_id, last_id)
+                yield events
+
+                if count == self.batch:
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                while not subscription.event.wait(min(self.heartbeat, remaining)):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    yield ': ping\n\n'
+        finally:
+            self.unsubscribe(subscription)
+
+
+def _event(event_id, name, data):
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {name}\ndata: {serializers.dumps(data).decode()}\n\n'
+
+
+unread_counts = UnreadCounts()
+hub = NotificationHub()
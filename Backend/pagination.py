@@ -0,0 +1,79 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request, current_app
+from sqlalchemy import func
+
+from models import db
+
+# Постраничная выдача для лент.
+# Режим page/per_page (OFFSET + COUNT) оставлен для старых клиентов,
+# при наличии параметра cursor используется keyset по (created_at, id) без подсчёта total
+# (для сводок, упорядоченных по времени обновления, - по (updated_at, id)).
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(item, field='created_at'):
+    payload = json.dumps([getattr(item, field).isoformat(), item.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Некорректный курсор')
+
+
+def get_per_page():
+    per_page = request.args.get('per_page', current_app.config['DEFAULT_PER_PAGE'], type=int)
+    return max(1, min(per_page, current_app.config['MAX_PER_PAGE']))
+
+
+def keyset_page(query, model, cursor, per_page, field='created_at'):
+    column = getattr(model, field)
+    if cursor:
+        position, item_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            column < position,
+            db.and_(column == position, model.id < item_id)
+        ))
+
+    items = query.order_by(column.desc(), model.id.desc())\
+        .limit(per_page + 1)\
+        .all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1], field)
+    return items, next_cursor
+
+
+def paginate_listing(query, model):
+    """Возвращает (элементы страницы, поля пагинации для ответа)"""
+    per_page = get_per_page()
+
+    if 'cursor' in request.args:
+        items, next_cursor = keyset_page(query, model, request.args.get('cursor'), per_page)
+        return items, {
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(model.created_at.desc(), model.id.desc())\
+        .paginate(page=page, per_page=per_page, error_out=False, count=False)
+    # COUNT только по id, без подзапроса со всеми (в том числе отложенными) колонками
+    pagination.total = query.with_entities(func.count(model.id)).order_by(None).scalar()
+    return pagination.items, {
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'current_page': page
+    }
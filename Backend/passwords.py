@@ -0,0 +1,158 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+try:
+    import fcntl
+except ImportError:  # Windows: ограничение действует в пределах процесса
+    fcntl = None
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from serving import cooperative
+
+# Хеширование паролей вне потока запроса.
+# pbkdf2/scrypt занимают CPU на сотни миллисекунд. Вычисления идут в отдельном пуле из
+# PASSWORD_HASH_WORKERS потоков: hashlib отпускает GIL на время pbkdf2_hmac/scrypt, так что
+# хеши считаются параллельно, а пул процессов не нужен (он заново импортировал бы app.py).
+# Число одновременных операций на весь сервер (все воркеры gunicorn) ограничено
+# PASSWORD_HASH_SLOTS: слот - файл в PASSWORD_HASH_SLOTS_PATH под flock, так что sync-воркеры
+# делят один лимит, а слот умершего воркера освобождает ядро. Без свободного слота сразу
+# выбрасывается HasherBusy (ответ 503), и воркер остаётся свободен для остальных запросов.
+# Хеш, не уложившийся в PASSWORD_HASH_TIMEOUT, тоже даёт HasherBusy; слот держится до его конца.
+# PASSWORD_HASH_METHOD задаётся в полном виде, как он записывается в хеш
+# ('pbkdf2:sha256:600000', 'scrypt:32768:8:1'): хеши с другими параметрами пересчитываются при входе.
+# При PASSWORD_HASH_WORKERS = 0 хеширование выполняется в текущем потоке.
+# Под gevent потоки threading становятся гринлетами, поэтому берётся пул настоящих потоков gevent:
+# хеш считается вне цикла событий, остальные запросы воркера продолжают обслуживаться.
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(hashed, password):
+    return check_password_hash(hashed, password)
+
+
+class SlotFiles:
+    """Счётный семафор между процессами на файлах с flock"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._files = None
+        self._pid = None
+        self._held = set()
+        self._lock = threading.Lock()
+        self._local = threading.BoundedSemaphore(size) if fcntl is None else None
+
+    def _open(self):
+        # Блокировки flock принадлежат открытому файлу, поэтому после fork файлы открываются заново
+        if self._pid != os.getpid():
+            os.makedirs(self.path, exist_ok=True)
+            self._files = [os.open(os.path.join(self.path, f'slot-{i}'), os.O_RDWR | os.O_CREAT, 0o600)
+                           for i in range(self.size)]
+            self._held = set()
+            self._pid = os.getpid()
+        return self._files
+
+    def acquire(self):
+        """Номер занятого слота или None, если все заняты"""
+        if self._local is not None:
+            return 0 if self._local.acquire(blocking=False) else None
+        with self._lock:
+            for index, fd in enumerate(self._open()):
+                if index in self._held:
+                    continue
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(index)
+                return index
+        return None
+
+    def release(self, index):
+        if self._local is not None:
+            self._local.release()
+            return
+        with self._lock:
+            if index in self._held:
+                fcntl.flock(self._files[index], fcntl.LOCK_UN)
+                self._held.discard(index)
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'pbkdf2:sha256:600000'
+        self.salt_length = 16
+        self.workers = 0
+        self.timeout = 10
+        self._slots = None
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        size = app.config['PASSWORD_HASH_SLOTS']
+        path = app.config['PASSWORD_HASH_SLOTS_PATH'] or os.path.join(app.instance_path, 'password_slots')
+        self._slots = SlotFiles(path, size) if size else None
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, hashed, password):
+        return self._run(_verify, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return hashed.split('$', 1)[0] != self.method
+
+    def _executor(self):
+        # Пул создаётся лениво и заново после fork воркера gunicorn
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                if cooperative():
+                    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+                    self._pool = NativeThreadPoolExecutor(self.workers)
+                else:
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        slot = None
+        if self._slots is not None:
+            slot = self._slots.acquire()
+            if slot is None:
+                raise HasherBusy('Сервер перегружен, повторите попытку позже')
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._release(slot)
+
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self._release(slot)
+            raise
+        future.add_done_callback(lambda _: self._release(slot))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy('Сервер перегружен, повторите попытку позже')
+
+    def _release(self, slot):
+        if slot is not None:
+            self._slots.release(slot)
+
+hasher = PasswordHasher()
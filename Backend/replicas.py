@@ -0,0 +1,197 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+from flask_jwt_extended import decode_token
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+from database import apply_pragmas, is_memory_sqlite
+from models import db
+from tasks import run_periodically
+
+# Чтение с реплик.
+# GET/HEAD-запросы выполняют SELECT на одной из исправных реплик DATABASE_REPLICA_URLS
+# (по кругу, см. routing.RoutingSession), все записи идут в основную базу.
+# Чтобы пользователь видел свои изменения, после успешного изменяющего запроса его чтения
+# REPLICA_STICKY_SECONDS идут в основную базу: метка хранится в cookie и, для запросов с JWT,
+# в памяти воркера по id пользователя. Реплики проверяются запросом SELECT 1 раз в
+# REPLICA_HEALTH_SECONDS; недоступная реплика исключается до следующей успешной проверки.
+# Для локальной проверки реплики-файлы SQLite копируются из основной базы через backup API
+# (flask replica-sync или фоном раз в REPLICA_SQLITE_SYNC_SECONDS).
+
+STICKY_COOKIE = 'mb_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def _sqlite_path(url):
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.engines = []
+        self.sticky_seconds = 10
+        self._healthy = []
+        self._cycle = None
+        self._sticky_users = {}    # user_id -> время, до которого чтения идут в основную базу
+        self._lock = threading.Lock()
+        self._last_check = 0
+        self._last_sync = 0
+
+    def init_app(self, app):
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        self.engines = [self._create_engine(app, url) for url in app.config['DATABASE_REPLICA_URLS']]
+        self._set_healthy(self.engines)
+        if not self.engines:
+            return
+
+        app.before_request(self._route)
+        app.after_request(self._stick)
+        if app.config['REPLICA_HEALTH_SECONDS'] > 0:
+            run_periodically(app, 'replica-health', app.config['REPLICA_HEALTH_SECONDS'], self.check_health)
+        if app.config['REPLICA_SQLITE_SYNC_SECONDS'] > 0:
+            run_periodically(app, 'replica-sync', app.config['REPLICA_SQLITE_SYNC_SECONDS'], self.sync_sqlite)
+
+    def _create_engine(self, app, url):
+        url = make_url(url)
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        if url.get_backend_name() == 'sqlite':
+            if is_memory_sqlite(url):
+                raise ValueError('Реплика не может быть базой SQLite в памяти')
+            if not os.path.isabs(url.database):
+                # Относительные пути, как и у основной базы, считаются от instance-каталога
+                url = url.set(database=os.path.join(app.instance_path, url.database))
+        engine = create_engine(url, **options)
+        pragmas = app.config.get('SQLITE_PRAGMAS')
+        if url.get_backend_name() == 'sqlite' and pragmas:
+            event.listen(engine, 'connect',
+                         lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
+        return engine
+
+    # Выбор базы для запроса
+
+    def read_engine(self):
+        """Следующая исправная реплика или None"""
+        with self._lock:
+            if not self._healthy:
+                return None
+            return next(self._cycle)
+
+    def _route(self):
+        if request.method not in READ_METHODS or self._is_sticky():
+            return
+        g.read_engine = self.read_engine()
+
+    def _stick(self, response):
+        if request.method in READ_METHODS or request.method == 'OPTIONS' or response.status_code >= 400:
+            return response
+        until = time.time() + self.sticky_seconds
+        user_id = self._request_user()
+        if user_id is not None:
+            with self._lock:
+                self._sticky_users[user_id] = until
+        response.set_cookie(STICKY_COOKIE, str(int(until) + 1), max_age=self.sticky_seconds + 1,
+                            httponly=True, samesite='Lax')
+        return response
+
+    def _is_sticky(self):
+        now = time.time()
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+                return True
+        except ValueError:
+            pass
+        user_id = self._request_user()
+        if user_id is None:
+            return False
+        with self._lock:
+            until = self._sticky_users.get(user_id)
+            if until is not None and until <= now:
+                del self._sticky_users[user_id]
+                until = None
+        return until is not None
+
+    def _request_user(self):
+        # Только для выбора базы: подпись проверяется, но отзыв и срок - нет
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return None
+        try:
+            return decode_token(header[7:], allow_expired=True).get('sub')
+        except Exception:
+            return None
+
+    # Проверка реплик
+
+    def check_health(self):
+        healthy = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                healthy.append(engine)
+            except Exception:
+                engine.dispose()
+        self._set_healthy(healthy)
+        self._last_check = time.time()
+        self._forget_sticky()
+        return len(healthy)
+
+    def _set_healthy(self, engines):
+        with self._lock:
+            self._healthy = list(engines)
+            self._cycle = itertools.cycle(self._healthy) if self._healthy else None
+
+    def _forget_sticky(self):
+        now = time.time()
+        with self._lock:
+            for user_id in [user_id for user_id, until in self._sticky_users.items() if until <= now]:
+                del self._sticky_users[user_id]
+
+    # Синхронизация реплик SQLite (локальная проверка)
+
+    def sync_sqlite(self):
+        """Копирование основной базы SQLite во все реплики-файлы SQLite"""
+        primary = _sqlite_path(db.engine.url)
+        if primary is None:
+            return 0
+        synced = 0
+        source = sqlite3.connect(primary)
+        try:
+            for engine in self.engines:
+                path = _sqlite_path(engine.url)
+                if path is None:
+                    continue
+                target = sqlite3.connect(path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                synced += 1
+        finally:
+            source.close()
+        self._last_sync = time.time()
+        return synced
+
+    def stats(self):
+        with self._lock:
+            healthy = set(map(id, self._healthy))
+            return {
+                'replicas': [
+                    {'url': engine.url.render_as_string(hide_password=True), 'healthy': id(engine) in healthy}
+                    for engine in self.engines
+                ],
+                'sticky_users': len(self._sticky_users),
+                'since_last_check_seconds': round(time.time() - self._last_check, 3) if self._last_check else None,
+                'since_last_sync_seconds': round(time.time() - self._last_sync, 3) if self._last_sync else None,
+            }
+
+
+replicas = ReplicaRouter()
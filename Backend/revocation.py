@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, jsonify
+from sqlalchemy import select
+
+from models import db, RevokedToken, User
+from tasks import run_periodically
+
+# Отзыв JWT до истечения срока.
+# Отозванные jti и "отсечки" хранятся в таблице revoked_tokens. Отсечка - новая версия токенов
+# пользователя (users.token_version): каждый токен при выдаче получает claim ver, и токены с меньшей
+# версией отклоняются. Время выдачи (iat) для этого не годится - у него точность в секунду, и токен,
+# выданный в ту же секунду до смены пароля, остался бы действующим. Каждый воркер держит их в памяти: фильтр Блума отсекает подавляющее большинство
+# проверок одним хешем, точное множество подтверждает попадания. Новые строки догружаются по id
+# раз в REVOCATION_SYNC_SECONDS, свои отзывы применяются сразу - проверка токена не делает запросов к БД.
+
+users_table = User.__table__
+# Версия отсечки удалённого аккаунта: недействительны все его токены
+DELETED_VERSION = 2 ** 31 - 1
+
+
+class BloomFilter:
+    def __init__(self, bits=1 << 20, hashes=7):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Blocklist:
+    def __init__(self):
+        self.bloom_bits = 1 << 20
+        self.bloom_hashes = 7
+        self.sync_interval = 2
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(self.bloom_bits, self.bloom_hashes)
+        self._tokens = {}       # jti -> expires_at (timestamp)
+        self._cutoffs = {}      # user_id -> token_version, токены с меньшим ver недействительны
+        self._last_id = 0
+        self._loaded = False
+        self._last_sync = 0
+
+    def init_app(self, app, jwt):
+        self.bloom_bits = app.config['REVOCATION_BLOOM_BITS']
+        self.bloom_hashes = app.config['REVOCATION_BLOOM_HASHES']
+        self.sync_interval = app.config['REVOCATION_SYNC_SECONDS']
+        self._bloom = BloomFilter(self.bloom_bits, self.bloom_hashes)
+        jwt.additional_claims_loader(self._claims)
+        jwt.token_in_blocklist_loader(self._check)
+        jwt.revoked_token_loader(self._revoked)
+        if self.sync_interval > 0:
+            run_periodically(app, 'revocation-sync', self.sync_interval, self.sync)
+
+    # Проверка
+
+    def is_revoked(self, payload):
+        if not self._loaded:
+            self.sync()
+        cutoff = self._cutoffs.get(payload.get('sub'))
+        if cutoff is not None and payload.get('ver', 0) < cutoff:
+            return True
+        jti = payload.get('jti')
+        return jti in self._bloom and jti in self._tokens
+
+    def _check(self, jwt_header, jwt_payload):
+        return self.is_revoked(jwt_payload)
+
+    def _claims(self, identity):
+        # Версия читается с основной базы: реплика могла ещё не получить отзыв из этого же запроса
+        version = db.session.execute(
+            select(users_table.c.token_version).where(users_table.c.id == identity),
+            bind_arguments={'bind': db.engine}
+        ).scalar()
+        return {'ver': version or 0}
+
+    def _revoked(self, jwt_header, jwt_payload):
+        return jsonify({'success': False, 'error': 'Сессия завершена, войдите снова'}), 401
+
+    # Отзыв
+
+    def revoke(self, payload):
+        """Отзыв одного токена по его payload (jti, sub, exp)"""
+        expires_at = datetime.fromtimestamp(payload['exp'])
+        token = RevokedToken(jti=payload['jti'], user_id=payload['sub'], expires_at=expires_at)
+        db.session.add(token)
+        db.session.commit()
+        self._apply_token(token.jti, expires_at.timestamp())
+
+    def revoke_all(self, user_id):
+        """Отзыв всех выданных токенов пользователя; токены, созданные после вызова, действуют"""
+        version = db.session.execute(
+            users_table.update().where(users_table.c.id == user_id)
+            .values(token_version=users_table.c.token_version + 1)
+            .returning(users_table.c.token_version)
+        ).scalar()
+        if version is None:
+            version = DELETED_VERSION
+        now = datetime.now()
+        longest = max(current_app.config['JWT_ACCESS_TOKEN_EXPIRES'], current_app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+        db.session.add(RevokedToken(jti=None, user_id=user_id, token_version=version,
+                                    revoked_at=now, expires_at=now + longest))
+        db.session.commit()
+        self._apply_cutoff(user_id, version)
+
+    # Синхронизация с таблицей
+
+    def sync(self):
+        now = datetime.now()
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti, RevokedToken.user_id,
+                                RevokedToken.expires_at, RevokedToken.token_version)\
+            .filter(RevokedToken.id > self._last_id, RevokedToken.expires_at > now)\
+            .order_by(RevokedToken.id)\
+            .all()
+        for row_id, jti, user_id, expires_at, token_version in rows:
+            if jti is None:
+                self._apply_cutoff(user_id, token_version or 0)
+            else:
+                self._apply_token(jti, expires_at.timestamp())
+        with self._lock:
+            if rows:
+                self._last_id = max(self._last_id, rows[-1][0])
+            self._loaded = True
+            self._last_sync = time.time()
+        self._forget_expired(now)
+
+    def _apply_token(self, jti, expires_at):
+        with self._lock:
+            self._tokens[jti] = expires_at
+            self._bloom.add(jti)
+
+    def _apply_cutoff(self, user_id, version):
+        with self._lock:
+            self._cutoffs[user_id] = max(self._cutoffs.get(user_id, 0), version)
+
+    def _forget_expired(self, now):
+        # Истёкшие токены отклонит сама проверка exp - убираем их из памяти и из таблицы
+        timestamp = now.timestamp()
+        with self._lock:
+            expired = [jti for jti, expires_at in self._tokens.items() if expires_at <= timestamp]
+            if len(expired) < max(1000, len(self._tokens) // 2):
+                return
+            for jti in expired:
+                del self._tokens[jti]
+            self._bloom = BloomFilter(self.bloom_bits, self.bloom_hashes)
+            for jti in self._tokens:
+                self._bloom.add(jti)
+        RevokedToken.query.filter(RevokedToken.expires_at <= now).delete(synchronize_session=False)
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tokens': len(self._tokens),
+                'cutoffs': len(self._cutoffs),
+                'last_id': self._last_id,
+                'since_last_sync_seconds': round(time.time() - self._last_sync, 3) if self._last_sync else None,
+            }
+
+
+blocklist = Blocklist()
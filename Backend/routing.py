@@ -0,0 +1,16 @@
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Сессия с маршрутизацией чтения на реплику.
+# Если для текущего запроса выбрана реплика (g.read_engine, см. replicas.py), SELECT-запросы идут
+# на неё; flush и INSERT/UPDATE/DELETE всегда выполняются на основной базе.
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and has_request_context():
+            engine = g.get('read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -1,4 +1,5 @@
-from app import app
+from app import app, bootstrap
 
 if __name__ == '__main__':
+    bootstrap()
     app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,192 @@
+import html
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import defer
+
+from models import db, User, Post, Playlist
+
+# Полнотекстовый поиск.
+# SQLite: внешние FTS5-таблицы *_fts, синхронизируются триггерами на insert/update/delete.
+# PostgreSQL: GIN-индексы по выражению to_tsvector(...), которые СУБД поддерживает сама.
+# Для остальных СУБД остаётся старый поиск через ilike.
+
+SEARCH_TYPES = {
+    'users': {
+        'model': User,
+        'table': 'users',
+        'columns': ['username', 'bio'],
+        'snippet_column': 'bio',
+        'deferred': [],
+        'where': '',
+    },
+    'posts': {
+        'model': Post,
+        'table': 'posts',
+        'columns': ['title', 'content', 'track_name', 'artist_name'],
+        'snippet_column': 'content',
+        'deferred': ['content'],
+        'where': '',
+    },
+    'playlists': {
+        'model': Playlist,
+        'table': 'playlists',
+        'columns': ['name', 'description'],
+        'snippet_column': 'description',
+        'deferred': ['description'],
+        'where': 'AND t.is_public = :is_public',
+    },
+}
+
+# snippet()/ts_headline возвращают исходный текст пользователя, поэтому СУБД отмечает совпадения
+# управляющими символами, а теги <mark> ставятся уже после экранирования HTML
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+def fts_table(name):
+    return f'{SEARCH_TYPES[name]["table"]}_fts'
+
+
+def pg_vector(name, alias=''):
+    prefix = f'{alias}.' if alias else ''
+    parts = " || ' ' || ".join(f"coalesce({prefix}{column}, '')" for column in SEARCH_TYPES[name]['columns'])
+    return f"to_tsvector('simple', {parts})"
+
+
+def search_backend():
+    return db.engine.dialect.name if db.engine.dialect.name in ('sqlite', 'postgresql') else None
+
+
+# Схема
+
+def _create_sqlite_index(connection, name):
+    table = SEARCH_TYPES[name]['table']
+    fts = fts_table(name)
+    columns = SEARCH_TYPES[name]['columns']
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column_list}, "
+        f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def create_search_indexes(connection):
+    dialect = connection.dialect.name
+    for name in SEARCH_TYPES:
+        if dialect == 'sqlite':
+            _create_sqlite_index(connection, name)
+        elif dialect == 'postgresql':
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_{SEARCH_TYPES[name]["table"]}_fts '
+                f'ON {SEARCH_TYPES[name]["table"]} USING GIN ({pg_vector(name)})'
+            ))
+    rebuild_search_index(connection)
+
+
+def rebuild_search_index(connection):
+    """Заполнение индекса существующими строками (для PostgreSQL индекс строится сам)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for name in SEARCH_TYPES:
+        fts = fts_table(name)
+        connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+# Запросы
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def _match_expression(terms, dialect):
+    if dialect == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _ranked_ids(name, match, dialect, limit, offset):
+    config = SEARCH_TYPES[name]
+    table = config['table']
+
+    if dialect == 'sqlite':
+        fts = fts_table(name)
+        sql = (
+            f"SELECT {fts}.rowid, snippet({fts}, -1, :start, :end, '…', 16) "
+            f"FROM {fts} JOIN {table} t ON t.id = {fts}.rowid "
+            f"WHERE {fts} MATCH :match {config['where']} "
+            f"ORDER BY bm25({fts}) LIMIT :limit OFFSET :offset"
+        )
+    else:
+        vector = pg_vector(name, 't')
+        sql = (
+            f"SELECT t.id, ts_headline('simple', coalesce(t.{config['snippet_column']}, ''), q, "
+            f"'StartSel=' || :start || ', StopSel=' || :end || ', MaxWords=30, MinWords=10') "
+            f"FROM {table} t, to_tsquery('simple', :match) q "
+            f"WHERE {vector} @@ q {config['where']} "
+            f"ORDER BY ts_rank({vector}, q) DESC LIMIT :limit OFFSET :offset"
+        )
+
+    rows = db.session.execute(text(sql), {
+        'match': match,
+        'start': SNIPPET_START,
+        'end': SNIPPET_END,
+        'is_public': True,
+        'limit': limit,
+        'offset': offset,
+    }).fetchall()
+    return [(row[0], _highlight(row[1])) for row in rows]
+
+
+def _highlight(snippet):
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+def _like_ids(name, query, limit, offset):
+    config = SEARCH_TYPES[name]
+    model = config['model']
+    q = model.query.filter(db.or_(
+        *[getattr(model, column).ilike(f'%{query}%') for column in config['columns']]
+    ))
+    if name == 'playlists':
+        q = q.filter_by(is_public=True)
+    return [(item.id, None) for item in q.order_by(model.id.desc()).offset(offset).limit(limit).all()]
+
+
+def search(name, query, page=1, per_page=10):
+    """Найденные объекты в порядке релевантности: ([(model, snippet)], has_more)"""
+    dialect = search_backend()
+    offset = (max(page, 1) - 1) * per_page
+
+    if dialect:
+        terms = _terms(query)
+        if not terms:
+            return [], False
+        ranked = _ranked_ids(name, _match_expression(terms, dialect), dialect, per_page + 1, offset)
+    else:
+        ranked = _like_ids(name, query, per_page + 1, offset)
+
+    has_more = len(ranked) > per_page
+    ranked = ranked[:per_page]
+
+    config = SEARCH_TYPES[name]
+    model = config['model']
+    ids = [item_id for item_id, _ in ranked]
+    # Длинные тексты в выдаче не нужны: вместо них excerpt и snippet
+    query = model.query.options(*[defer(getattr(model, column)) for column in config['deferred']])
+    items = {item.id: item for item in query.filter(model.id.in_(ids)).all()} if ids else {}
+    return [(items[item_id], snippet) for item_id, snippet in ranked if item_id in items], has_more
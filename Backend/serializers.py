@@ -0,0 +1,262 @@
+import json
+from datetime import date
+from decimal import Decimal
+from operator import attrgetter
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Сериализация моделей и JSON-ответов.
+# Для каждой модели задана схема: явный список колонок (читаются одним attrgetter) и вычисляемые
+# поля. У списочных эндпоинтов свой вариант схемы (summary), у карточки объекта - полный (full).
+# Связанные данные, загруженные пакетно (loaders.py), передаются через контекст dump(...):
+# users={id: dict}, stats=..., tracks_counts={id: n} и т.д.; без контекста берутся через relationship.
+# Даты остаются объектами datetime - их переводит в ISO 8601 JSON-провайдер.
+
+
+class Schema:
+    def __init__(self, fields, **computed):
+        self.fields = tuple(fields)
+        self.computed = computed
+        getter = attrgetter(*self.fields)
+        self._values = getter if len(self.fields) > 1 else lambda obj: (getter(obj),)
+
+    def extend(self, fields=(), **computed):
+        return Schema(self.fields + tuple(fields), **{**self.computed, **computed})
+
+    def dump(self, obj, **context):
+        data = dict(zip(self.fields, self._values(obj)))
+        for name, compute in self.computed.items():
+            data[name] = compute(obj, context)
+        return data
+
+    def dump_many(self, objs, **context):
+        return [self.dump(obj, **context) for obj in objs]
+
+
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text):
+    """Начало длинного текста для списков (хранится в колонке excerpt)"""
+    if text is None:
+        return None
+    return text[:EXCERPT_LENGTH] + '...' if len(text) > EXCERPT_LENGTH else text
+
+
+def stored_excerpt(source):
+    """Колонка excerpt; сам длинный текст в списках не загружается (defer)"""
+    def compute(obj, context):
+        if obj.excerpt is not None:
+            return obj.excerpt
+        return make_excerpt(getattr(obj, source))
+    return compute
+
+
+def related_user(id_attr, relationship):
+    """Пользователь из контекста users={id: dict}, иначе через relationship"""
+    get_id = attrgetter(id_attr)
+
+    def compute(obj, context):
+        users = context.get('users')
+        if users is not None:
+            return users.get(get_id(obj))
+        user = getattr(obj, relationship)
+        return user.to_dict() if user else None
+    return compute
+
+
+def _genres(user, context):
+    if not user.genres:
+        return []
+    try:
+        return json.loads(user.genres)
+    except ValueError:
+        return []
+
+
+def _user_stats(user, context):
+    stats = context.get('stats')
+    return stats if stats is not None else user.get_stats()
+
+
+user_profile = Schema(
+    ('id', 'username', 'email', 'bio', 'avatar_url', 'location', 'website', 'is_verified',
+     'created_at', 'last_login'),
+    genres=_genres,
+)
+
+user_full = user_profile.extend(stats=_user_stats)
+
+user_stats_schema = Schema(
+    ('posts_count', 'followers_count', 'following_count', 'friends_count', 'playlists_count', 'reviews_count')
+)
+
+post_summary = Schema(
+    ('id', 'title', 'post_type', 'track_name', 'artist_name', 'created_at', 'likes_count', 'comments_count'),
+    content=stored_excerpt('content'),
+    author=related_user('user_id', 'author'),
+)
+
+post_full = Schema(
+    ('id', 'title', 'content', 'post_type', 'track_id', 'track_name', 'artist_name', 'album_art_url',
+     'media_url', 'created_at', 'updated_at', 'likes_count', 'comments_count', 'views_count'),
+    author=related_user('user_id', 'author'),
+    tags=lambda post, context: [tag.name for tag in post.tags],
+)
+
+
+def _replies_count(comment, context):
+    replies = context.get('replies_counts')
+    if replies is not None:
+        return replies.get(comment.id, 0)
+    return len(comment.replies)
+
+
+comment_schema = Schema(
+    ('id', 'content', 'post_id', 'parent_comment_id', 'likes_count', 'created_at'),
+    author=related_user('user_id', 'author'),
+    replies_count=_replies_count,
+)
+
+track_schema = Schema(
+    ('id', 'track_id', 'track_name', 'artist_name', 'album_name', 'album_art_url', 'duration_ms', 'added_at'),
+    added_by=related_user('added_by', 'added_by_user'),
+)
+
+
+def _tracks_count(playlist, context):
+    counts = context.get('tracks_counts')
+    if counts is not None:
+        return counts.get(playlist.id, 0)
+    return len(playlist.tracks)
+
+
+def _tracks(playlist, context):
+    tracks = context.get('tracks')
+    if tracks is None:
+        tracks = playlist.tracks[:20]
+    return track_schema.dump_many(tracks, users=context.get('users'))
+
+
+playlist_summary = Schema(
+    ('id', 'name', 'is_public', 'created_at'),
+    description=stored_excerpt('description'),
+    creator=related_user('user_id', 'creator'),
+    tracks_count=_tracks_count,
+)
+
+playlist_full = Schema(
+    ('id', 'name', 'description', 'is_public', 'created_at', 'cover_url', 'updated_at', 'plays_count'),
+    creator=related_user('user_id', 'creator'),
+    tracks_count=_tracks_count,
+    tracks=_tracks,
+)
+
+review_schema = Schema(
+    ('id', 'rating', 'content', 'track_id', 'track_name', 'artist_name', 'album_art_url', 'likes_count',
+     'created_at'),
+    author=related_user('user_id', 'author'),
+)
+
+concert_summary = Schema(
+    ('id', 'artist_name', 'venue', 'city', 'country', 'date', 'ticket_url', 'image_url')
+)
+
+concert_full = concert_summary.extend(('description', 'price_range', 'created_at'))
+
+course_summary = Schema(
+    ('id', 'title', 'instructor', 'instrument', 'level', 'price', 'duration', 'created_at'),
+    description=stored_excerpt('description'),
+)
+
+course_full = Schema(
+    ('id', 'title', 'description', 'instructor', 'instrument', 'level', 'price', 'duration', 'created_at',
+     'video_url', 'thumbnail_url', 'students_count', 'rating')
+)
+
+tag_schema = Schema(('id', 'name', 'tag_type', 'popularity'))
+
+follow_schema = Schema(
+    ('id', 'created_at'),
+    follower=related_user('follower_id', 'follower'),
+    followed=related_user('followed_id', 'followed'),
+)
+
+enrollment_schema = Schema(
+    ('id', 'enrolled_at', 'completed_at', 'progress', 'rating'),
+    user=related_user('user_id', 'user'),
+    course=lambda enrollment, context: course_full.dump(enrollment.course),
+)
+
+notification_schema = Schema(
+    ('id', 'type', 'title', 'message', 'reference_id', 'reference_type', 'actor_id', 'is_read', 'created_at')
+)
+
+message_schema = Schema(
+    ('id', 'content', 'is_read', 'created_at'),
+    sender=related_user('sender_id', 'sender'),
+    receiver=related_user('receiver_id', 'receiver'),
+)
+
+conversation_schema = Schema(
+    ('id', 'peer_id', 'unread_count', 'updated_at'),
+    peer=related_user('peer_id', 'peer'),
+    last_message=lambda conversation, context: {
+        'id': conversation.last_message_id,
+        'excerpt': conversation.last_message_excerpt,
+        'sender_id': conversation.last_sender_id,
+        'created_at': conversation.updated_at,
+    },
+)
+
+saved_post_schema = Schema(
+    ('id', 'user_id', 'saved_at', 'folder'),
+    post=lambda saved, context: saved.post.to_dict(),
+)
+
+
+# JSON-провайдер Flask: orjson, если установлен, иначе стандартный json
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    return DefaultJSONProvider.default(value)
+
+
+class JSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+    ensure_ascii = False
+
+    if orjson is not None:
+        def dumps(self, obj, **kwargs):
+            if kwargs:
+                return super().dumps(obj, **kwargs)
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS),
+                mimetype=self.mimetype
+            )
+
+
+def dumps(obj):
+    """Сериализация в bytes тем же кодировщиком, что и ответы"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False).encode()
@@ -0,0 +1,13 @@
+# Режим обслуживания запросов.
+# sync-воркеры gunicorn обрабатывают по одному запросу; в режиме gevent (gunicorn.conf.py,
+# GUNICORN_WORKER_CLASS=gevent) стандартная библиотека пропатчена и запросы идут в гринлетах.
+# Код, которому важна разница (пул соединений, пул хеширования паролей), проверяет cooperative().
+
+
+def cooperative():
+    """True, если сокеты и потоки пропатчены gevent"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
@@ -0,0 +1,68 @@
+import threading
+import time
+from datetime import datetime
+
+from models import db, User, Post, Playlist, Comment
+from tasks import run_periodically
+
+# Снимок общей статистики сайта для /api/stats.
+# Считается фоновым потоком раз в STATS_REFRESH_SECONDS, запрос отдаёт готовый словарь.
+# Если поток не успел (или выключен), снимок пересчитывается при запросе.
+
+
+class SiteStats:
+    def __init__(self):
+        self.interval = 60
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._computed_at = 0
+
+    def refresh(self):
+        snapshot = compute_site_stats()
+        with self._lock:
+            self._snapshot = snapshot
+            self._computed_at = time.time()
+        return snapshot
+
+    def age(self):
+        return time.time() - self._computed_at
+
+    def get(self):
+        if self._snapshot is None or self.age() > self.interval * 2:
+            return self.refresh()
+        return self._snapshot
+
+
+def compute_site_stats():
+    popular_posts = db.session.query(
+        Post.id, Post.title, User.username, Post.likes_count, Post.comments_count
+    ).join(User, User.id == Post.user_id)\
+        .order_by(Post.likes_count.desc())\
+        .limit(5)\
+        .all()
+
+    return {
+        'stats': {
+            'total_users': User.query.count(),
+            'total_posts': Post.query.count(),
+            'total_playlists': Playlist.query.filter_by(is_public=True).count(),
+            'total_comments': Comment.query.count()
+        },
+        'popular_posts': [{
+            'id': post_id,
+            'title': title,
+            'author': username,
+            'likes_count': likes_count,
+            'comments_count': comments_count
+        } for post_id, title, username, likes_count, comments_count in popular_posts],
+        'generated_at': datetime.now().isoformat()
+    }
+
+
+site_stats = SiteStats()
+
+
+def init_site_stats(app):
+    site_stats.interval = app.config['STATS_REFRESH_SECONDS']
+    if site_stats.interval > 0:
+        run_periodically(app, 'site-stats', site_stats.interval, site_stats.refresh)
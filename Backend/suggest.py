@@ -0,0 +1,263 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User, UserStats, Post, Tag, Follow
+from tasks import run_periodically
+
+# Подсказки для строки поиска из индекса префиксов в памяти процесса.
+# Индекс строится при старте воркера, дальше обновляется по закоммиченным изменениям
+# User/Post/Tag/Follow этого процесса и периодически перестраивается целиком
+# (чтобы подтянуть записи, сделанные другими воркерами). Запрос к /api/search/suggest
+# в базу не ходит.
+
+# Для коротких префиксов с тысячами совпадений лучшие TOP_K кешируются,
+# иначе каждый запрос сортировал бы весь диапазон
+BROAD_RANGE = 256
+TOP_K = 50
+
+
+def _key(text):
+    return text.strip().lower()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []      # отсортированный список (ключ, тип, текст)
+        self._entries = {}   # (тип, текст) -> {'score': ..., 'id': ...}
+        self._user_names = {}
+        self._top = {}       # префикс -> лучшие (тип, текст) для широких диапазонов
+        self.built_at = None
+
+    def replace(self, entries):
+        """entries: iterable (тип, текст, очки, id)"""
+        new_entries = {}
+        for kind, text, score, ref_id in entries:
+            if not text or not text.strip():
+                continue
+            entry = new_entries.setdefault((kind, text), {'score': 0, 'id': ref_id})
+            entry['score'] += score or 0
+        keys = sorted((_key(text), kind, text) for kind, text in new_entries)
+        user_names = {entry['id']: text for (kind, text), entry in new_entries.items() if kind == 'user'}
+
+        with self._lock:
+            self._keys = keys
+            self._entries = new_entries
+            self._user_names = user_names
+            self._top = {}
+            self.built_at = time.time()
+
+    def adjust(self, kind, text, delta, ref_id=None):
+        """Изменение очков записи; запись создаётся при первом появлении и удаляется при нуле"""
+        if not text or not text.strip():
+            return
+        with self._lock:
+            entry = self._entries.get((kind, text))
+            if entry is None:
+                if delta <= 0 and kind in ('artist', 'track'):
+                    return
+                entry = self._entries[(kind, text)] = {'score': 0, 'id': ref_id}
+                insort(self._keys, (_key(text), kind, text))
+                if kind == 'user':
+                    self._user_names[ref_id] = text
+            entry['score'] += delta
+            if entry['score'] <= 0 and kind in ('artist', 'track'):
+                self._remove_locked(kind, text)
+            else:
+                self._update_top(kind, text)
+
+    def remove(self, kind, text):
+        with self._lock:
+            self._remove_locked(kind, text)
+
+    def _remove_locked(self, kind, text):
+        entry = self._entries.pop((kind, text), None)
+        if entry is None:
+            return
+        item = (_key(text), kind, text)
+        position = bisect_left(self._keys, item)
+        if position < len(self._keys) and self._keys[position] == item:
+            del self._keys[position]
+        if kind == 'user':
+            self._user_names.pop(entry['id'], None)
+        for prefix in list(self._top):
+            if (kind, text) in self._top[prefix]:
+                del self._top[prefix]
+
+    def _score(self, item):
+        return self._entries[item]['score']
+
+    def _update_top(self, kind, text):
+        key = _key(text)
+        for prefix, top in self._top.items():
+            if not key.startswith(prefix):
+                continue
+            if (kind, text) not in top:
+                top.append((kind, text))
+            top.sort(key=self._score, reverse=True)
+            del top[TOP_K:]
+
+    def user_name(self, user_id):
+        return self._user_names.get(user_id)
+
+    def set_score(self, kind, text, score):
+        with self._lock:
+            entry = self._entries.get((kind, text))
+            if entry is not None:
+                entry['score'] = score
+                self._update_top(kind, text)
+
+    def lookup(self, prefix, limit=8, kinds=None):
+        prefix = _key(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            lo = bisect_left(self._keys, (prefix,))
+            hi = bisect_left(self._keys, (prefix + '\uffff',))
+
+            best = None
+            if hi - lo > BROAD_RANGE and limit <= TOP_K:
+                top = self._top.get(prefix)
+                if top is None:
+                    top = self._top[prefix] = heapq.nlargest(
+                        TOP_K, ((kind, text) for _, kind, text in self._keys[lo:hi]), key=self._score
+                    )
+                best = [item for item in top if not kinds or item[0] in kinds][:limit]
+                if len(best) < limit and kinds:
+                    best = None
+
+            if best is None:
+                candidates = ((kind, text) for _, kind, text in self._keys[lo:hi] if not kinds or kind in kinds)
+                best = heapq.nlargest(limit, candidates, key=self._score)
+
+            return [{
+                'type': kind,
+                'text': text,
+                'id': self._entries[(kind, text)]['id'],
+                'score': self._entries[(kind, text)]['score'],
+            } for kind, text in best]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+suggestions = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def load_entries():
+    followers = dict(db.session.query(UserStats.user_id, UserStats.followers_count).all())
+    for user_id, username in db.session.query(User.id, User.username).all():
+        yield 'user', username, followers.get(user_id, 0), user_id
+
+    for column, kind in ((Post.artist_name, 'artist'), (Post.track_name, 'track')):
+        rows = db.session.query(column, func.count()).filter(column.isnot(None)).group_by(column).all()
+        for text, count in rows:
+            yield kind, text, count, None
+
+    for tag_id, name, popularity in db.session.query(Tag.id, Tag.name, Tag.popularity).all():
+        yield 'tag', name, popularity or 0, tag_id
+
+
+def build_suggestions():
+    suggestions.replace(list(load_entries()))
+    return len(suggestions)
+
+
+def ensure_suggestions():
+    """Первое построение индекса - при первом обращении, а не при импорте приложения"""
+    if suggestions.built_at is None:
+        with _build_lock:
+            if suggestions.built_at is None:
+                build_suggestions()
+
+
+def start_refresh(app, interval):
+    """Фоновое перестроение индекса раз в interval секунд"""
+    return run_periodically(app, 'suggest-refresh', interval, build_suggestions)
+
+
+# Инкрементальные обновления: копим изменения в сессии и применяем после коммита
+
+def _pending(session):
+    return session.info.setdefault('suggest_changes', [])
+
+
+def _queue(change):
+    def listener(mapper, connection, target):
+        _pending(object_session(target)).append(change(target))
+    return listener
+
+
+def _user_added(user):
+    username, user_id = user.username, user.id
+    return lambda: suggestions.adjust('user', username, 0, ref_id=user_id)
+
+
+def _user_removed(user):
+    username = user.username
+    return lambda: suggestions.remove('user', username)
+
+
+def _post_changed(delta):
+    def change(post):
+        artist_name, track_name = post.artist_name, post.track_name
+
+        def apply():
+            suggestions.adjust('artist', artist_name, delta)
+            suggestions.adjust('track', track_name, delta)
+        return apply
+    return change
+
+
+def _tag_saved(tag):
+    name, popularity, tag_id = tag.name, tag.popularity or 0, tag.id
+
+    def apply():
+        suggestions.adjust('tag', name, 0, ref_id=tag_id)
+        suggestions.set_score('tag', name, popularity)
+    return apply
+
+
+def _tag_removed(tag):
+    name = tag.name
+    return lambda: suggestions.remove('tag', name)
+
+
+def _follow_changed(delta):
+    def change(follow):
+        followed_id = follow.followed_id
+
+        def apply():
+            username = suggestions.user_name(followed_id)
+            if username:
+                suggestions.adjust('user', username, delta, ref_id=followed_id)
+        return apply
+    return change
+
+
+event.listen(User, 'after_insert', _queue(_user_added))
+event.listen(User, 'after_delete', _queue(_user_removed))
+event.listen(Post, 'after_insert', _queue(_post_changed(1)))
+event.listen(Post, 'after_delete', _queue(_post_changed(-1)))
+event.listen(Tag, 'after_insert', _queue(_tag_saved))
+event.listen(Tag, 'after_update', _queue(_tag_saved))
+event.listen(Tag, 'after_delete', _queue(_tag_removed))
+event.listen(Follow, 'after_insert', _queue(_follow_changed(1)))
+event.listen(Follow, 'after_delete', _queue(_follow_changed(-1)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    for apply in session.info.pop('suggest_changes', []):
+        apply()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop('suggest_changes', None)
@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+import time
+
+from models import db
+
+# Фоновые задачи внутри воркера.
+# Очередь обрабатывается отдельным потоком (запускается при первой задаче, поэтому
+# безопасна для fork в gunicorn). Задачи выполняются в app context со своей сессией.
+# При BACKGROUND_TASKS = False задачи выполняются сразу, в текущем запросе.
+
+
+class TaskQueue:
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.app.config.get('BACKGROUND_TASKS', True):
+            fn(*args, **kwargs)
+            return
+        self._ensure_started()
+        self._queue.put((fn, args, kwargs))
+
+    def join(self):
+        """Ожидание выполнения всех поставленных задач"""
+        self._queue.join()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='background-tasks', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                with self.app.app_context():
+                    try:
+                        fn(*args, **kwargs)
+                    except Exception:
+                        db.session.rollback()
+                        self.app.logger.exception('Ошибка фоновой задачи %s', fn.__name__)
+                    finally:
+                        db.session.remove()
+            finally:
+                self._queue.task_done()
+
+
+class PeriodicJobs:
+    """Периодические задачи воркера.
+    Потоки запускаются не при импорте, а при первом запросе в процессе: при gunicorn --preload
+    приложение импортируется в мастере, а потоки после fork в воркеры не переходят."""
+
+    def __init__(self):
+        self._jobs = []
+        self._threads = []
+        self._pid = None
+        self._apps = set()
+        self._lock = threading.Lock()
+
+    def add(self, app, name, interval, fn):
+        with self._lock:
+            self._jobs.append((app, name, interval, fn))
+            if id(app) not in self._apps:
+                self._apps.add(id(app))
+                app.before_request(self.ensure_started)
+            started = self._pid == os.getpid()
+        if started:
+            self._threads.append(self._start(app, name, interval, fn))
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [self._start(*job) for job in self._jobs]
+
+    def names(self):
+        return [thread.name for thread in self._threads if thread.is_alive()]
+
+    @staticmethod
+    def _start(app, name, interval, fn):
+        def loop():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        fn()
+                    except Exception as e:
+                        db.session.rollback()
+                        app.logger.warning('Периодическая задача %s: %s', name, e)
+                    finally:
+                        db.session.remove()
+
+        thread = threading.Thread(target=loop, name=name, daemon=True)
+        thread.start()
+        return thread
+
+
+periodic = PeriodicJobs()
+
+
+def run_periodically(app, name, interval, fn):
+    """Вызов fn() в app context раз в interval секунд (поток стартует с первым запросом воркера)"""
+    periodic.add(app, name, interval, fn)
+
+
+tasks = TaskQueue()